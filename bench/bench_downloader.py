@@ -0,0 +1,130 @@
+"""Compare yt-dlp's own downloader with aria2c on files served locally.
+
+Starts an HTTP server on 127.0.0.1 over a temp dir with generated test
+files, then runs them through the queue engine (real yt-dlp, generic
+extractor) once per downloader. Reports wall time, throughput and how many
+progress updates reached the job, i.e. whether the progress bar moves.
+
+    python bench/bench_downloader.py [--files 4] [--size 64] [-j 2] [-x 16] [-s 16]
+    python bench/bench_downloader.py --serve-only     # just the server, for manual runs
+
+aria2c is skipped if it isn't installed. The server ignores Range requests,
+so this measures overhead and progress plumbing, not multi-connection gains.
+"""
+import argparse
+import functools
+import http.server
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TICK = 0.05
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class QuietServer(http.server.ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        pass  # the generic extractor drops its probe connection mid-body
+
+
+def serve(directory: str) -> http.server.ThreadingHTTPServer:
+    server = QuietServer(('127.0.0.1', 0), functools.partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_files(directory: str, count: int, size_mib: int) -> list[str]:
+    names = []
+    chunk = os.urandom(1024 * 1024)
+    for i in range(count):
+        name = f"test{i:02d}.mp4"
+        with open(os.path.join(directory, name), 'wb') as f:
+            for _ in range(size_mib):
+                f.write(chunk)
+        names.append(name)
+    return names
+
+
+def run(engine_mod, urls: list[str], out_dir: str, jobs: int, aria2: bool, x: int, s: int) -> tuple[float, int]:
+    engine = engine_mod.QueueEngine()
+    engine.max_parallel = jobs
+    engine.host_limit = 0  # everything is on 127.0.0.1
+    engine.on_log = lambda lines: None
+    updates = 0
+    options = engine_mod.DownloadOptions('best', aria2=aria2, aria2_connections=x, aria2_split=s)
+    for url in urls:
+        engine.add_url(url, options, out_dir)
+    engine.pump()
+    t0 = time.perf_counter()
+    engine.start()
+    seen: dict[int, object] = {}
+    while not engine.idle:
+        time.sleep(TICK)
+        engine.pump()
+        for job in engine.active.values():
+            if job.last_event is not None and seen.get(job.job_id) is not job.last_event:
+                seen[job.job_id] = job.last_event
+                updates += 1
+    wall = time.perf_counter() - t0
+    failed = engine.failed
+    engine.close()
+    if failed:
+        print(f"  {failed} загрузок с ошибкой, см. логи в {engine_mod.LOGS_DIR}")
+    return wall, updates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--files', type=int, default=4)
+    parser.add_argument('--size', type=int, default=64, help='MiB per file')
+    parser.add_argument('-j', '--jobs', type=int, default=2)
+    parser.add_argument('-x', type=int, default=16, help='aria2c connections per server')
+    parser.add_argument('-s', type=int, default=16, help='aria2c split')
+    parser.add_argument('--serve-only', action='store_true')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='ytdlp-dl-bench-')
+    www = os.path.join(tmp, 'www')
+    os.makedirs(www)
+    names = make_files(www, args.files, args.size)
+    server = serve(www)
+    base = f"http://127.0.0.1:{server.server_address[1]}/"
+    if args.serve_only:
+        print(f"Раздаю {www} на {base} (Ctrl-C для выхода)")
+        for name in names:
+            print(base + name)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            return
+
+    os.environ.update({'HOME': tmp, 'APPDATA': tmp})  # throwaway config dir
+    sys.path.insert(0, ROOT)
+    import ytdlp_engine
+
+    urls = [base + name for name in names]
+    total_mib = args.files * args.size
+    modes = [('native', False)] + ([('aria2c', True)] if shutil.which('aria2c') else [])
+    if len(modes) == 1:
+        print("aria2c не найден, сравнение только со встроенным загрузчиком")
+    for label, aria2 in modes:
+        out_dir = os.path.join(tmp, f"out-{label}")
+        wall, updates = run(ytdlp_engine, urls, out_dir, args.jobs, aria2, args.x, args.s)
+        got = sum(1 for name in os.listdir(out_dir) if not name.endswith(('.part', '.txt')))
+        print(f"{label:7} {wall:6.2f} s, {total_mib / wall:7.1f} MiB/s, "
+              f"{got}/{args.files} files, {updates} progress updates")
+    server.shutdown()
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
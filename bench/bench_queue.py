@@ -0,0 +1,237 @@
+"""Drive the download queue end-to-end against the fake yt-dlp.
+
+YTDLP_BIN points at bench/fake_ytdlp.py and the config dir goes to a temp
+dir, so nothing touches the network or the real journal. Reports:
+
+    lines/s      output lines read and classified by the worker threads
+    tick lag     how late the host tick ran (p50/p99/max): the UI loop lag
+    dispatch     fake exit -> next job handed to a worker in the freed slot
+    turnaround   fake exit -> next fake start (dispatch + process startup)
+    memory       RSS at start, peak and end (run long to see growth)
+
+POSIX only (the fake is started through a small sh launcher).  Usage:
+    python bench/bench_queue.py [--items 200] [--lines 200] [--rate 0] [-j 4]
+    python bench/bench_queue.py --items 5000 --lines 50 -j 8      # long run, memory
+    python bench/bench_queue.py --replay recorded.txt --rate 500  # real yt-dlp output
+    python bench/bench_queue.py --items 200 --lines 10 --batch 10   # several URLs per process
+    python bench/bench_queue.py --gui                             # real window, needs a display
+"""
+import argparse
+import itertools
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE = os.path.join(ROOT, 'bench', 'fake_ytdlp.py')
+TICK = 0.05  # same as final.OUTPUT_FLUSH_MS
+
+
+def make_launcher(tmp: str) -> str:
+    """Executable that runs the fake with this interpreter, no PATH lookups."""
+    path = os.path.join(tmp, 'yt-dlp')
+    with open(path, 'w') as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE}" "$@"\n')
+    os.chmod(path, 0o755)
+    return path
+
+
+def rss_bytes() -> int:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # peak only
+
+
+def pct(xs: list[float], q: float) -> float:
+    if not xs:
+        return 0.0
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(q * len(xs)))]
+
+
+class Recorder:
+    """Collects timings from engine callbacks and the host tick."""
+
+    def __init__(self):
+        self.log_lines = 0
+        self.starts: list[float] = []
+        self.dispatched: list[float] = []
+        self.exits: list[float] = []
+        self.lags: list[float] = []
+        self.rss: list[int] = [rss_bytes()]
+        self._last_sample = time.monotonic()
+
+    def on_log(self, lines: list[tuple[str, str]]):
+        self.log_lines += len(lines)
+        for text, _tag in lines:
+            i = text.find('[fake] ')
+            if i >= 0:
+                kind, ts = text[i + 7:].split()
+                (self.starts if kind == 'start' else self.exits).append(float(ts))
+
+    def on_job_started(self, _job):
+        self.dispatched.append(time.time())
+
+    def sample(self):
+        now = time.monotonic()
+        if now - self._last_sample >= 1.0:
+            self._last_sample = now
+            self.rss.append(rss_bytes())
+
+    def gaps(self, starts: list[float], parallel: int) -> list[float]:
+        # the first wave is started by start(); every later start fills a freed slot
+        starts = sorted(starts)[parallel:]
+        exits = sorted(self.exits)[:len(starts)]
+        return [s - e for s, e in zip(starts, exits)]
+
+
+def job_stats(eng, job) -> str:
+    """A worker's progress text, as a repaint would format it; `eng` is ytdlp_engine."""
+    if job.stage == 'post':
+        return 'обработка…'
+    ev = job.last_event
+    if ev is None:
+        return ''
+    size = eng.format_bytes
+    total = f" / {size(job.bytes_finished + ev.total_bytes)}" if ev.total_bytes and ev.status != 'finished' else ''
+    frag = f" [{ev.fragment_index}/{ev.fragment_count}]" if ev.fragment_index and ev.fragment_count else ''
+    return f"{size(job.downloaded_bytes)}{total} {size(job.speed)}/s {eng.format_eta(ev.eta)}{frag}"
+
+
+def run_headless(engine, rec: Recorder, eng):
+    engine.start()
+    last = time.perf_counter()
+    while not engine.idle:
+        time.sleep(TICK)
+        now = time.perf_counter()
+        rec.lags.append(max(0.0, now - last - TICK))
+        engine.pump()
+        for job in engine.active.values():
+            job_stats(eng, job)  # what a progress repaint costs
+        rec.sample()
+        last = time.perf_counter()
+    engine.pump()
+
+
+def run_gui(app, rec: Recorder):
+    import tkinter as tk
+    root = app.master
+    app.opt_open_after_queue.set(False)
+    show = app.engine.on_log
+    app.engine.on_log = lambda lines: (rec.on_log(lines), show(lines))
+    add_row = app.engine.on_job_started
+    app.engine.on_job_started = lambda job: (rec.on_job_started(job), add_row(job))
+    app.engine.on_queue_finished = lambda stopped: root.quit()
+    expected = [time.perf_counter() + TICK]
+
+    def probe():
+        now = time.perf_counter()
+        rec.lags.append(max(0.0, now - expected[0]))
+        rec.sample()
+        expected[0] = now + TICK
+        try:
+            root.after(int(TICK * 1000), probe)
+        except tk.TclError:
+            pass
+    root.after(int(TICK * 1000), probe)
+    app.start_queue_download()
+    root.mainloop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--items', type=int, default=200)
+    parser.add_argument('--lines', type=int, default=200, help='progress updates per item')
+    parser.add_argument('--rate', type=float, default=0, help='lines/s per fake, 0 = no limit')
+    parser.add_argument('--duration', type=float, default=0, help='seconds per item (overrides --rate)')
+    parser.add_argument('--fail-every', type=int, default=0, help='every Nth item exits with 1')
+    parser.add_argument('--replay', help='recorded yt-dlp output to replay')
+    parser.add_argument('-j', '--jobs', type=int, default=4)
+    parser.add_argument('--batch', type=int, default=1, help='URLs per yt-dlp process (engine default: batching on)')
+    parser.add_argument('--gui', action='store_true', help='drive the Tk window instead of the bare engine')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='ytdlp-bench-')
+    os.environ.update({
+        'YTDLP_BIN': make_launcher(tmp),
+        'HOME': tmp, 'APPDATA': tmp,  # throwaway config dir
+        'FAKE_YTDLP_LINES': str(args.lines),
+        'FAKE_YTDLP_RATE': str(args.rate),
+        'FAKE_YTDLP_DURATION': str(args.duration),
+    })
+    if args.replay:
+        os.environ['FAKE_YTDLP_REPLAY'] = os.path.abspath(args.replay)
+    sys.path.insert(0, ROOT)
+    import ytdlp_engine
+
+    counter = itertools.count()
+    classify = ytdlp_engine.classify_line
+
+    def counting_classify(job, line):
+        next(counter)
+        return classify(job, line)
+    ytdlp_engine.classify_line = counting_classify
+
+    rec = Recorder()
+    if args.gui:
+        import tkinter as tk
+        import final
+        root = tk.Tk()
+        root.withdraw()
+        app = final.YTDLPGUI(root)
+        app.max_parallel.set(args.jobs)
+        app.host_limit.set(0)  # every fake item is on one host
+        app.batch_items.set(args.batch)
+        engine = app.engine
+    else:
+        engine = ytdlp_engine.QueueEngine()
+        engine.max_parallel = args.jobs
+        engine.host_limit = 0  # every fake item is on one host
+        engine.batch_items = args.batch
+        engine.on_log = rec.on_log
+        engine.on_job_started = rec.on_job_started
+
+    options = ytdlp_engine.DownloadOptions(fmt=ytdlp_engine.FORMAT_OPTIONS['Видео (WebM)']['1080p'])
+    final_dir = os.path.join(tmp, 'downloads')
+    for i in range(args.items):
+        fail = '&exit=1' if args.fail_every and (i + 1) % args.fail_every == 0 else ''
+        engine.add_url(f'https://fake.invalid/watch?v={i:011d}{fail}', options, final_dir)
+    engine.pump()
+
+    t0 = time.perf_counter()
+    if args.gui:
+        run_gui(app, rec)
+    else:
+        run_headless(engine, rec, ytdlp_engine)
+    wall = time.perf_counter() - t0
+    rec.rss.append(rss_bytes())
+    lines = next(counter)
+
+    ms = 1000
+    dispatch = rec.gaps(rec.dispatched, args.jobs)
+    turn = rec.gaps(rec.starts, args.jobs)
+    mib = 1024 * 1024
+    print(f"items:      {args.items} (failed {engine.failed}), parallel {args.jobs}, batch {args.batch}, "
+          f"{'gui' if args.gui else 'headless'}")
+    print(f"wall:       {wall:.2f} s, {args.items / wall:.1f} items/s")
+    print(f"lines:      {lines} read, {lines / wall:.0f} lines/s; {rec.log_lines} shown in the log")
+    print(f"tick lag:   p50 {pct(rec.lags, .5) * ms:.1f} ms, p99 {pct(rec.lags, .99) * ms:.1f} ms, "
+          f"max {max(rec.lags, default=0) * ms:.1f} ms (tick {TICK * ms:.0f} ms)")
+    print(f"dispatch:   p50 {pct(dispatch, .5) * ms:.1f} ms, p99 {pct(dispatch, .99) * ms:.1f} ms, "
+          f"max {max(dispatch, default=0) * ms:.1f} ms")
+    print(f"turnaround: p50 {pct(turn, .5) * ms:.1f} ms, p99 {pct(turn, .99) * ms:.1f} ms, "
+          f"max {max(turn, default=0) * ms:.1f} ms over {len(turn)} slots")
+    print(f"memory:     start {rec.rss[0] / mib:.1f} MiB, peak {max(rec.rss) / mib:.1f} MiB, "
+          f"end {rec.rss[-1] / mib:.1f} MiB ({(rec.rss[-1] - rec.rss[0]) / mib:+.1f})")
+    if args.gui:
+        app.on_closing()
+    else:
+        engine.close()
+
+
+if __name__ == '__main__':
+    main()
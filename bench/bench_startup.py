@@ -0,0 +1,68 @@
+"""Time-to-first-frame of the GUI, with a cold and a warm dependency cache.
+
+Each run starts a fresh interpreter that imports final, builds the window
+and reports once the first frame has been drawn; the parent measures from
+spawn to that report, so interpreter start and imports are included.
+
+Needs a display (or Xvfb); no numbers have been recorded yet.  Usage:
+    python bench/bench_startup.py [runs]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r'''
+import sys, tkinter as tk
+sys.path.insert(0, {root!r})
+import final
+root = tk.Tk()
+app = final.YTDLPGUI(root)
+def first_frame():
+    print('FIRST_FRAME', flush=True)
+    root.after(50, root.destroy)
+root.after_idle(first_frame)
+root.mainloop()
+'''
+
+
+def time_to_first_frame() -> float:
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, '-c', CHILD.format(root=ROOT)],
+                            stdout=subprocess.PIPE, text=True)
+    for line in proc.stdout:
+        if line.startswith('FIRST_FRAME'):
+            elapsed = time.perf_counter() - t0
+            break
+    else:
+        raise RuntimeError('child exited before drawing a frame')
+    proc.wait()
+    return elapsed
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    sys.path.insert(0, ROOT)
+    import ytdlp_engine as engine
+
+    cold = []
+    for _ in range(runs):
+        try:
+            engine.PROBE_CACHE_FILE.unlink()
+        except FileNotFoundError:
+            pass
+        cold.append(time_to_first_frame())
+    # let the last background probe write the cache, then measure warm starts
+    engine.probe_binaries([engine.YTDLP_BIN, 'ffmpeg'])
+    warm = [time_to_first_frame() for _ in range(runs)]
+
+    for name, xs in (('cold cache', cold), ('warm cache', warm)):
+        print(f"{name}: median {statistics.median(xs) * 1000:.0f} ms, "
+              f"min {min(xs) * 1000:.0f} ms over {runs} runs")
+
+
+if __name__ == '__main__':
+    main()
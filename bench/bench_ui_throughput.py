@@ -0,0 +1,96 @@
+"""Measure how many yt-dlp output lines/sec the Tk log can absorb.
+
+before: one master.after(0, ...) per line, each doing its own Text.insert
+        and see(END) -- a copy of the pre-OutputBuffer _log, not today's one
+after:  reader thread -> OutputBuffer -> one insert per UI tick
+
+Needs a display (or Xvfb); no numbers have been recorded yet.  Usage:
+    python bench/bench_ui_throughput.py [lines]
+"""
+import os
+import sys
+import threading
+import time
+import tkinter as tk
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import final  # noqa: E402
+
+LINE = '[download]  42.3% of ~ 123.45MiB at    5.67MiB/s ETA 00:17 (frag 12/40)\n'
+
+
+def _pump(root: tk.Tk, producer, is_done) -> tuple[float, float]:
+    """Run `producer` in a thread and spin the Tk loop until `is_done()`.
+
+    Returns (seconds, worst gap between two event-loop iterations).
+    """
+    produced = threading.Event()
+
+    def run():
+        producer()
+        produced.set()
+
+    t0 = last = time.perf_counter()
+    worst = 0.0
+    threading.Thread(target=run, daemon=True).start()
+    while not (produced.is_set() and is_done()):
+        root.update()
+        now = time.perf_counter()
+        worst = max(worst, now - last)
+        last = now
+    return time.perf_counter() - t0, worst
+
+
+def _old_log(widget: tk.Text, text: str, tag: str | None = None):
+    """The per-line _log this tree had before OutputBuffer, kept as the baseline."""
+    if not widget.winfo_exists():
+        return
+    try:
+        widget.configure(state='normal')
+        if tag:
+            widget.insert(tk.END, text, tag)
+        else:
+            widget.insert(tk.END, text)
+        widget.see(tk.END)
+        widget.configure(state='disabled')
+    except tk.TclError:
+        pass
+
+
+def bench_before(app: final.YTDLPGUI, root: tk.Tk, n: int) -> tuple[float, float]:
+    pending = [n]
+
+    def log_one(line):
+        _old_log(app.log_text_widget, line, 'download')
+        pending[0] -= 1
+
+    def producer():
+        for _ in range(n):
+            root.after(0, log_one, LINE)
+
+    return _pump(root, producer, lambda: pending[0] == 0)
+
+
+def bench_after(app: final.YTDLPGUI, root: tk.Tk, n: int) -> tuple[float, float]:
+    def producer():
+        for _ in range(n):
+            app.engine.buffer.put(LINE, 'download')
+
+    return _pump(root, producer, lambda: not app.engine.buffer._lines)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    root = tk.Tk()
+    root.withdraw()
+    app = final.YTDLPGUI(root)
+    for name, fn in (('before', bench_before), ('after', bench_after)):
+        app.log_text_widget.configure(state='normal')
+        app.log_text_widget.delete('1.0', tk.END)
+        elapsed, worst = fn(app, root, n)
+        print(f"{name:>6}: {n / elapsed:10.0f} lines/s  ({elapsed:.2f}s, worst UI stall {worst * 1000:.0f} ms)")
+    root.destroy()
+
+
+if __name__ == '__main__':
+    main()
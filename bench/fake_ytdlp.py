@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""Stand-in for the yt-dlp binary: prints yt-dlp-shaped output, no network.
+
+Point the app at it with YTDLP_BIN (bench_queue.py does this itself):
+    YTDLP_BIN=/path/to/fake-yt-dlp python final.py
+
+Behaviour comes from environment variables; query parameters of the URL
+override them per item (e.g. https://fake.invalid/watch?v=abc&exit=1):
+    FAKE_YTDLP_LINES     progress updates per download        (lines, default 200)
+    FAKE_YTDLP_RATE      output lines per second, 0 = no limit (rate, default 0)
+    FAKE_YTDLP_DURATION  spread the output over this many s   (duration, overrides rate)
+    FAKE_YTDLP_EXIT      exit code                            (exit, default 0)
+    FAKE_YTDLP_ERROR     text of the ERROR line on failure    (error, e.g. "HTTP Error 429: Too Many Requests")
+    FAKE_YTDLP_SIZE      bytes reported per stream            (size, default 50 MiB)
+    FAKE_YTDLP_POST      seconds a post-processing run takes  (post, default 1)
+    FAKE_YTDLP_EXTRACT   seconds of extraction while --cache-dir (extract, default 0)
+                         holds no player data yet; the run then stores it
+    FAKE_YTDLP_REPLAY    file with recorded yt-dlp output to replay instead
+                         (record one with `yt-dlp ... > out.txt 2>&1`)
+
+With --downloader ...:aria2c in the arguments the progress comes as aria2c
+readout lines, as it does from the real thing. With -a <file> every URL in
+the file is "downloaded" in turn, like a yt-dlp batch run.
+
+The first and last lines are "[fake] start <time>" and "[fake] exit
+<time>" so a benchmark can measure spawn and turnaround latency.
+"""
+import hashlib
+import json
+import os
+import sys
+import time
+from urllib.parse import parse_qs, urlparse
+
+PROGRESS_PREFIX = '[progress] '  # see ytdlp_engine.PROGRESS_TEMPLATE
+
+
+def settings(url: str) -> dict:
+    env = os.environ
+    cfg = {
+        'lines': int(env.get('FAKE_YTDLP_LINES', 200)),
+        'rate': float(env.get('FAKE_YTDLP_RATE', 0)),
+        'duration': float(env.get('FAKE_YTDLP_DURATION', 0)),
+        'exit': int(env.get('FAKE_YTDLP_EXIT', 0)),
+        'error': env.get('FAKE_YTDLP_ERROR', ''),
+        'size': int(env.get('FAKE_YTDLP_SIZE', 50 * 1024 * 1024)),
+        'post': float(env.get('FAKE_YTDLP_POST', 1)),
+        'extract': float(env.get('FAKE_YTDLP_EXTRACT', 0)),
+        'replay': env.get('FAKE_YTDLP_REPLAY', ''),
+    }
+    for key, values in parse_qs(urlparse(url).query).items():
+        if key in cfg and key != 'replay':
+            cfg[key] = type(cfg[key])(values[-1])
+    return cfg
+
+
+def video_id(url: str) -> str:
+    v = parse_qs(urlparse(url).query).get('v')
+    return v[-1] if v else hashlib.sha1(url.encode()).hexdigest()[:11]
+
+
+def synthetic(argv: list[str], url: str, vid: str, cfg: dict) -> list[str]:
+    """Output of a verbose single-video run: extraction, download(s), merge."""
+    fmt = argv[argv.index('-f') + 1] if '-f' in argv else 'best'
+    template = '--progress-template' in argv
+    aria2 = any(arg.endswith(':aria2c') or arg == 'aria2c' for arg in argv)
+    out = [f"[debug] Command-line config: {argv}",
+           "[debug] Encodings: locale UTF-8, fs utf-8, pref UTF-8, out utf-8, error utf-8, screen utf-8",
+           "[debug] yt-dlp version fake@2099.01.01",
+           f"[youtube] Extracting URL: {url}",
+           f"[youtube] {vid}: Downloading webpage",
+           f"[youtube] {vid}: Downloading player API JSON",
+           f"[info] {vid}: Downloading 1 format(s): {fmt}"]
+    streams = ['f303.webm', 'f251.webm'] if '+' in fmt else ['webm']
+    size = cfg['size']
+    per_stream = max(1, cfg['lines'] // len(streams))
+    for ext in streams:
+        out.append(f"[download] Destination: Fake video [{vid}].{ext}")
+        for i in range(1, per_stream + 1):
+            done = size * i // per_stream
+            status = 'finished' if i == per_stream else 'downloading'
+            if aria2 and status == 'downloading':
+                # aria2c writes its own readout; yt-dlp only reports the finished file
+                out.append(f"[#2089b0 {done / 1048576:.1f}MiB/{size / 1048576:.1f}MiB({100 * done // size}%) "
+                           f"CN:16 DL:5.0MiB ETA:{(size - done) // (5 * 1024 * 1024)}s]")
+            elif template:
+                out.append(PROGRESS_PREFIX + vid + ' ' + json.dumps({
+                    'status': status, 'downloaded_bytes': done, 'total_bytes': size,
+                    'total_bytes_estimate': None, 'speed': 5.0 * 1024 * 1024,
+                    'eta': (size - done) // (5 * 1024 * 1024), 'elapsed': i * 0.01,
+                    'fragment_index': None, 'fragment_count': None}))
+            else:
+                out.append(f"[download] {100.0 * done / size:5.1f}% of {size / 1048576:.2f}MiB at 5.00MiB/s ETA 00:01")
+    if '--write-info-json' in argv:
+        out_dir = os.path.dirname(argv[argv.index('-o') + 1]) if '-o' in argv else '.'
+        info = os.path.join(out_dir, f"Fake video [{vid}].info.json")
+        with open(info, 'w', encoding='utf-8') as f:
+            json.dump({'id': vid, 'webpage_url': url}, f)
+        out.append(f"[info] Writing video metadata as JSON to: {info}")
+    if len(streams) > 1:
+        out.append(f'[Merger] Merging formats into "Fake video [{vid}].webm"')
+        out.append("Deleting original file Fake video [%s].f303.webm (pass -k to keep)" % vid)
+    if cfg['exit']:
+        out.append(f"ERROR: [youtube] {vid}: {cfg['error'] or 'Fake failure'} (exit {cfg['exit']})")
+    return out
+
+
+def extract(argv: list[str], cfg: dict):
+    """Work out the "player data" unless --cache-dir already has it, then cache it."""
+    cache = os.path.join(argv[argv.index('--cache-dir') + 1], 'youtube-nsig', 'fake.json') \
+        if '--cache-dir' in argv else None
+    if cache and os.path.exists(cache):
+        return
+    time.sleep(cfg['extract'])
+    if cache:
+        os.makedirs(os.path.dirname(cache), exist_ok=True)
+        with open(cache, 'w', encoding='utf-8') as f:
+            json.dump({'player': 'fake'}, f)
+
+
+def postprocess(argv: list[str]) -> int:
+    """--load-info-json run: no network, the post-processors take FAKE_YTDLP_POST s."""
+    with open(argv[argv.index('--load-info-json') + 1], encoding='utf-8') as f:
+        info = json.load(f)
+    vid, cfg = info['id'], settings(info.get('webpage_url', ''))
+    print(f"[fake] start {time.time():.6f}")
+    print(f"[info] {vid}: Downloading 1 format(s): {argv[argv.index('-f') + 1] if '-f' in argv else 'best'}")
+    print(f"[download] Fake video [{vid}].webm has already been downloaded", flush=True)
+    if '--audio-format' in argv:
+        print(f"[ExtractAudio] Destination: Fake video [{vid}].{argv[argv.index('--audio-format') + 1]}", flush=True)
+    time.sleep(cfg['post'])
+    if '--embed-thumbnail' in argv:
+        print(f'[EmbedThumbnail] ffmpeg: Adding thumbnail to "Fake video [{vid}]"')
+    print(f"[fake] exit {time.time():.6f}", flush=True)
+    return 0
+
+
+def run_one(argv: list[str], url: str) -> int:
+    cfg = settings(url)
+    vid = video_id(url)
+    extract(argv, cfg)
+    if '--skip-download' in argv:
+        return cfg['exit']
+    if cfg['replay']:
+        with open(cfg['replay'], 'r', encoding='utf-8', errors='replace') as f:
+            lines = [line.rstrip('\n') for line in f]
+    else:
+        lines = synthetic(argv, url, vid, cfg)
+
+    rate = len(lines) / cfg['duration'] if cfg['duration'] > 0 else cfg['rate']
+    write = sys.stdout.write
+    t0 = time.perf_counter()
+    for n, line in enumerate(lines, 1):
+        write(line + '\n')
+        if rate > 0:
+            sys.stdout.flush()
+            delay = t0 + n / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    if not cfg['exit'] and ('--extract-audio' in argv or '--embed-thumbnail' in argv):
+        write(f"[ExtractAudio] Destination: Fake video [{vid}].audio\n")  # post-processing in this run
+        sys.stdout.flush()
+        time.sleep(cfg['post'])
+    return cfg['exit']
+
+
+def main(argv: list[str]) -> int:
+    if '--version' in argv:
+        print('2099.01.01 (fake)')
+        return 0
+    if '--load-info-json' in argv:
+        return postprocess(argv)
+    if '-a' in argv:
+        # batch file: one URL per line, failures don't stop the rest (yt-dlp's default)
+        with open(argv[argv.index('-a') + 1], 'r', encoding='utf-8') as f:
+            urls = [line.strip() for line in f if line.strip()]
+    else:
+        urls = [argv[-1]] if argv else ['']
+    sys.stdout.write(f"[fake] start {time.time():.6f}\n")
+    rc = 0
+    for url in urls:
+        rc = run_one(argv, url) or rc
+    sys.stdout.write(f"[fake] exit {time.time():.6f}\n")
+    sys.stdout.flush()
+    return rc
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
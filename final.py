@@ -4,16 +4,30 @@ import subprocess
 import os
 import sys
 import threading
-import json
 import re
-from pathlib import Path
+import time
+
+from ytdlp_engine import (
+    BACKEND_INPROCESS, BACKEND_SUBPROCESS, DEFAULT_ARIA2_CONNECTIONS, DEFAULT_ARIA2_SPLIT, DEFAULT_BATCH_ITEMS,
+    DEFAULT_DOWNLOAD_DIR, DEFAULT_HOST_PARALLEL, DEFAULT_MAX_PARALLEL, DEFAULT_SUBFOLDER, FORMAT_OPTIONS,
+    MAX_BATCH_ITEMS, MAX_PARALLEL_LIMIT, YTDLP_BIN,
+    DownloadJob, DownloadOptions, QueueEngine, QueueItem, SettingsStore,
+    estimate_size, find_format, format_bytes, format_eta, inprocess_available, match_format, parse_rate,
+    probe_binaries, prune_item_logs, sanitize_subfolder, write_url_file,
+)
 
 # ==========================
 #  CONFIG & CONSTANTS
 # ==========================
-APP_NAME = "yt-dlp-gui"
-YTDLP_BIN = "yt-dlp"
-DEFAULT_DOWNLOAD_DIR = os.path.join(os.path.expanduser('~'), 'Downloads')
+# Queue, journal, presets and command building live in ytdlp_engine.py.
+OUTPUT_FLUSH_MS = 50  # how often worker output is drained into the UI
+PROGRESS_MIN_INTERVAL = 0.1  # seconds between progress bar repaints
+QUEUE_VIEW_ROWS = 12  # rows the queue panel shows; also the only Treeview items that exist
+QUEUE_VIEW_REFRESH_MS = 250  # per-row status/percent/speed/ETA repaint, batched
+LOG_MAX_LINES = 2000  # on-screen log keeps only the tail
+LOG_VIEW_CHUNK = 256 * 1024  # bytes loaded per UI tick in the log viewer
+FORMAT_PROBE_DELAY_MS = 700  # pause after the last URL edit before formats are probed
+SETTINGS_SAVE_DELAY_MS = 1500  # debounce for config.json writes
 
 # UI Colors (YouTube Dark)
 colors = {
@@ -34,50 +48,204 @@ colors = {
     'selected_fg': '#F1F1F1',
 }
 
-# Format presets: (label -> yt-dlp -f expression)
-FORMAT_OPTIONS = {
-    'Видео (WebM)': {
-        '144p': 'bv*[ext=webm][height<=144]+ba*[ext=webm]',
-        '240p': 'bv*[ext=webm][height<=240]+ba*[ext=webm]',
-        '360p': 'bv*[ext=webm][height<=360]+ba*[ext=webm]',
-        '480p': 'bv*[ext=webm][height<=480]+ba*[ext=webm]',
-        '720p': 'bv*[ext=webm][height<=720]+ba*[ext=webm]',
-        '1080p': 'bv*[ext=webm][height<=1080]+ba*[ext=webm]',
-    },
-    'Видео (MP4/AVC)': {
-        '1080p (MP4)': 'bv*[vcodec*=avc1][height<=1080]+ba[ext=m4a]/bv*[ext=mp4][height<=1080]+ba[ext=m4a]'
-    },
-    'High Res (WebM)': {
-        '2K (1440p)': 'bv*[ext=webm][height<=1440]+ba*[ext=webm]',
-        '4K (2160p)': 'bv*[ext=webm][height<=2160]+ba*[ext=webm]',
-        '8K (4320p)': 'bv*[ext=webm][height<=4320]+ba*[ext=webm]',
-    },
-    'Аудио': {
-        'MP3 (192kbps)': 'ba/bestaudio',
-        'M4A (AAC)': 'ba*[ext=m4a]/bestaudio[ext=m4a]',
-        'OPUS (Lossy)': 'ba/bestaudio',
-        'WAV (Uncompressed)': 'ba/bestaudio',
-        'FLAC (Lossless)': 'ba/bestaudio',
-    }
-}
-
 # ==========================
-#  Helpers
+#  Queue panel
 # ==========================
+class QueueView:
+    """The queue as a table: a Treeview that only ever holds the visible rows.
+
+    Every item of the run (running, pending in dispatch order, finished) is
+    an id in `rows`; the Treeview has QUEUE_VIEW_ROWS items whose values are
+    rewritten from `rows` at the scroll offset, and only when they changed.
+    Scrolling or repainting a 5,000-item queue costs what a 10-item one does.
+    Pending rows can be dragged to reorder them.
+    """
+    COLUMNS = (('n', '#', 50, 'e'), ('url', 'Ссылка', 420, 'w'), ('status', 'Статус', 130, 'w'),
+               ('percent', '%', 55, 'e'), ('speed', 'Скорость', 90, 'e'), ('eta', 'Осталось', 70, 'e'))
+
+    def __init__(self, parent, engine: QueueEngine, height: int = QUEUE_VIEW_ROWS):
+        self.engine = engine
+        self.height = height
+        self.frame = tk.Frame(parent, bg=colors['bg'])
+        self.frame.grid_columnconfigure(0, weight=1)
+        self.tree = ttk.Treeview(self.frame, columns=[c[0] for c in self.COLUMNS], show='headings',
+                                 height=height, selectmode='browse', style='Queue.Treeview')
+        for name, title, width, anchor in self.COLUMNS:
+            self.tree.heading(name, text=title)
+            self.tree.column(name, width=width, anchor=anchor, stretch=name == 'url')
+        self.tree.tag_configure('running', foreground=colors['log_download'])
+        self.tree.tag_configure('failed', foreground=colors['error'])
+        self.tree.tag_configure('done', foreground=colors['button_hover'])
+        self.tree.grid(row=0, column=0, sticky='nsew')
+        self.scroll = ttk.Scrollbar(self.frame, command=self._on_scroll)
+        self.scroll.grid(row=0, column=1, sticky='ns')
+        for slot in range(height):
+            self.tree.insert('', 'end', iid=str(slot))
+
+        self.rows: list[int] = []  # QueueStore ids in display order
+        self.offset = 0  # index in `rows` of the top slot
+        self.selected: int | None = None
+        self.finished: dict[int, tuple[QueueItem, str]] = {}  # id -> (item, final status), newest last
+        self._jobs: dict[int, DownloadJob] = {}  # running, by item id
+        self._pending: dict[int, QueueItem] = {}
+        self._pending_span = (0, 0)  # slice of `rows` holding the pending queue
+        self._shown: list[tuple] = [()] * height  # (values, tag) currently in each slot
+        self._queue_version = -1
+        self._dirty = True
+        self._last_refresh = 0.0
+        self._drag_from: int | None = None
+
+        self.tree.bind('<<TreeviewSelect>>', self._on_select)
+        self.tree.bind('<ButtonPress-1>', self._on_press, add='+')
+        self.tree.bind('<ButtonRelease-1>', self._on_release)
+        self.tree.bind('<Up>', lambda _e: self._step(-1))
+        self.tree.bind('<Down>', lambda _e: self._step(1))
+        for seq in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+            self.tree.bind(seq, self._on_wheel)
+
+    # ---------- Data ----------
+    def job_started(self, _job: DownloadJob):
+        self._dirty = True
+
+    def job_finished(self, job: DownloadJob):
+        if self.engine.queue.get(job.item.item_id) is None:  # not requeued for a retry or a pause
+            status = 'готово' if job.return_code == 0 else 'остановлено' if job.stopped else f"ошибка {job.return_code}"
+            self.finished.pop(job.item.item_id, None)
+            self.finished[job.item.item_id] = (job.item, status)
+        self._dirty = True
+
+    def reset(self):
+        """New run: forget the previous run's finished rows."""
+        self.finished.clear()
+        self._rebuild()
+
+    def selected_job(self) -> DownloadJob | None:
+        return self._jobs.get(self.selected)
+
+    def selected_pending(self) -> QueueItem | None:
+        return self.engine.queue.get(self.selected) if self.selected is not None else None
+
+    def _rebuild(self):
+        engine = self.engine
+        running = sorted((*engine.active.values(), *engine.post_queue, *engine.post_active.values()),
+                         key=lambda job: job.job_id)
+        pending = engine.queue.ordered()
+        self._jobs = {job.item.item_id: job for job in running}
+        self._pending = {item.item_id: item for item in pending}
+        self.rows = [job.item.item_id for job in running]
+        self._pending_span = (len(self.rows), len(self.rows) + len(pending))
+        self.rows.extend(item.item_id for item in pending)
+        self.rows.extend(reversed(self.finished))
+        self._queue_version = engine.queue.version
+        self._dirty = False
+
+    def _values(self, n: int, item_id: int) -> tuple[tuple, str]:
+        job = self._jobs.get(item_id)
+        if job is not None:
+            if job.batch is not None and job.times.spawned is None:
+                return (n, job.url, 'в пакете', '', '', ''), 'running'  # yt-dlp hasn't got to it yet
+            if job.stage == 'post':
+                status = 'обработка' if job.job_id in self.engine.post_active else 'ждёт обработки'
+                return (n, job.url, status, '100%', '', ''), 'running'
+            ev = job.last_event
+            return (n, job.url, 'загрузка', f"{job.percent:.0f}%",
+                    f"{format_bytes(job.speed)}/s" if job.speed else '',
+                    format_eta(ev.eta) if ev and ev.eta is not None else ''), 'running'
+        item = self._pending.get(item_id)
+        if item is not None:
+            status = f"в очереди ({item.priority:+d})" if item.priority else 'в очереди'
+            return (n, item.url, status, '', '', ''), ''
+        item, status = self.finished[item_id]
+        return (n, item.url, status, '', '', ''), 'done' if status == 'готово' else 'failed'
+
+    # ---------- Painting ----------
+    def refresh(self, force: bool = False):
+        """UI tick: re-read the queue if it changed, then repaint the visible slots."""
+        now = time.monotonic()
+        if not force and now - self._last_refresh < QUEUE_VIEW_REFRESH_MS / 1000:
+            return
+        self._last_refresh = now
+        if self._dirty or self.engine.queue.version != self._queue_version:
+            self._rebuild()
+        self._paint()
+
+    def _paint(self):
+        total = len(self.rows)
+        self.offset = max(0, min(self.offset, total - self.height))
+        blank = ('',) * len(self.COLUMNS)
+        selected_slot = ()
+        for slot in range(self.height):
+            i = self.offset + slot
+            if i < total:
+                shown = self._values(i + 1, self.rows[i])
+                if self.rows[i] == self.selected:
+                    selected_slot = (str(slot),)
+            else:
+                shown = (blank, '')
+            if shown != self._shown[slot]:
+                self._shown[slot] = shown
+                self.tree.item(str(slot), values=shown[0], tags=(shown[1],))
+        if self.tree.selection() != selected_slot:
+            self.tree.selection_set(selected_slot)
+        if total > self.height:
+            self.scroll.set(self.offset / total, (self.offset + self.height) / total)
+        else:
+            self.scroll.set(0.0, 1.0)
+
+    # ---------- Input ----------
+    def _row_at(self, y: int) -> int | None:
+        slot = self.tree.identify_row(y)
+        return self.offset + int(slot) if slot else None
+
+    def _on_select(self, _event=None):
+        sel = self.tree.selection()
+        # empty when the selected row scrolled out of view: keep the item selected
+        if sel and self.offset + int(sel[0]) < len(self.rows):
+            self.selected = self.rows[self.offset + int(sel[0])]
+
+    def _on_scroll(self, *args):
+        if args[0] == 'moveto':
+            self.offset = int(float(args[1]) * len(self.rows))
+        elif args[0] == 'scroll':
+            self.offset += int(args[1]) * (self.height - 1 if args[2] == 'pages' else 1)
+        self._paint()
+
+    def _on_wheel(self, event):
+        down = event.num == 5 or (event.num != 4 and event.delta < 0)
+        self._on_scroll('scroll', 3 if down else -3, 'units')
+        return 'break'
+
+    def _step(self, delta: int):
+        """Arrow keys move the selection through the whole list, not just the visible slots."""
+        if not self.rows:
+            return 'break'
+        i = self.rows.index(self.selected) + delta if self.selected in self.rows else 0
+        i = max(0, min(i, len(self.rows) - 1))
+        self.selected = self.rows[i]
+        if i < self.offset:
+            self.offset = i
+        elif i >= self.offset + self.height:
+            self.offset = i - self.height + 1
+        self._paint()
+        return 'break'
+
+    def _on_press(self, event):
+        i = self._row_at(event.y)
+        start, end = self._pending_span
+        self._drag_from = self.rows[i] if i is not None and start <= i < end else None
+
+    def _on_release(self, event):
+        item_id, self._drag_from = self._drag_from, None
+        i = self._row_at(event.y)
+        start, end = self._pending_span
+        if item_id is None or i is None:
+            return
+        # dropped on a running row: to the head; on a finished or empty one: to the end
+        target = min(max(i, start), end - 1)
+        if self.rows[target] != item_id and self.engine.move(item_id, target - start):
+            self.selected = item_id
+            self.refresh(force=True)
 
-def platform_config_dir() -> Path:
-    """Return per-OS config dir."""
-    if sys.platform.startswith('win'):
-        base = os.environ.get('APPDATA') or os.path.expanduser('~')
-        return Path(base) / APP_NAME
-    elif sys.platform == 'darwin':
-        return Path.home() / 'Library' / 'Application Support' / APP_NAME
-    else:
-        return Path.home() / '.config' / APP_NAME
-
-CONFIG_DIR = platform_config_dir()
-CONFIG_DIR.mkdir(parents=True, exist_ok=True)
-CONFIG_FILE = CONFIG_DIR / 'config.json'
 
 # ==========================
 #  Main App
@@ -100,16 +268,46 @@ class YTDLPGUI:
         self.opt_embed_thumbnail = tk.BooleanVar(value=False)
         self.opt_embed_subs = tk.BooleanVar(value=False)
         self.opt_keep_temp = tk.BooleanVar(value=False)  # -k
+        self.opt_inprocess = tk.BooleanVar(value=False)  # yt_dlp module in warm workers
 
         self.net_threads = tk.IntVar(value=8)  # -N
+        self.opt_auto_threads = tk.BooleanVar(value=False)  # -N per host from past runs
+        self.opt_aria2 = tk.BooleanVar(value=False)  # HTTP(S) through aria2c
+        self.aria2_connections = tk.IntVar(value=DEFAULT_ARIA2_CONNECTIONS)  # aria2c -x
+        self.aria2_split = tk.IntVar(value=DEFAULT_ARIA2_SPLIT)  # aria2c -s
         self.limit_rate = tk.StringVar(value="")  # e.g. 5M
-
-        self.download_queue = []  # list[(url, command, final_dir)]
-        self.is_downloading = False
-        self.current_process: subprocess.Popen | None = None
+        self.total_rate = tk.StringVar(value="")  # e.g. 40M, shared by all running jobs
+
+        self.max_parallel = tk.IntVar(value=DEFAULT_MAX_PARALLEL)
+        self.host_limit = tk.IntVar(value=DEFAULT_HOST_PARALLEL)  # per site, 0 = no cap
+        self.opt_sjf = tk.BooleanVar(value=False)  # shortest job first instead of queue order
+        self.batch_items = tk.IntVar(value=DEFAULT_BATCH_ITEMS)  # compatible URLs per yt-dlp run
+
+        # the queue itself (journal, dedupe, workers) lives in the engine;
+        # its callbacks all run on the Tk thread from _drain_output
+        self.engine = QueueEngine()
+        self.engine.on_log = self._log_batch
+        self.engine.on_job_started = self._on_job_started
+        self.engine.on_job_finished = self._on_job_finished
+        self.engine.on_queue_finished = self._on_queue_finished
+        self.engine.on_error = messagebox.showerror
+        self.engine.on_formats = self._on_formats
+        self._probe_job: str | None = None
+        self._format_matches: dict[str, bool] = {}  # preset -> matches the current URL (probed)
+        self._last_progress_paint = 0.0
+        prune_item_logs()
 
         # load settings
+        self._settings_save_job: str | None = None
         self._load_settings()
+        self._on_parallel_changed()
+        self.max_parallel.trace_add('write', self._on_parallel_changed)
+        self.host_limit.trace_add('write', self._on_parallel_changed)
+        self.batch_items.trace_add('write', self._on_parallel_changed)
+        self.engine.auto_threads = self.opt_auto_threads.get()
+        self.opt_auto_threads.trace_add('write', self._on_auto_threads_changed)
+        self.engine.set_sjf(self.opt_sjf.get())
+        self.opt_sjf.trace_add('write', self._on_sjf_changed)
 
         # styles
         self._setup_styles()
@@ -120,7 +318,11 @@ class YTDLPGUI:
         # check deps (non-fatal)
         self._check_binaries_silent()
 
+        # pick up whatever the previous session left unfinished
+        self._restore_queue()
+
         master.protocol("WM_DELETE_WINDOW", self.on_closing)
+        self.master.after(OUTPUT_FLUSH_MS, self._drain_output)
 
     # ---------- UI / Styles ----------
     def _setup_styles(self):
@@ -152,6 +354,13 @@ class YTDLPGUI:
             ]})
         ])
 
+        # queue panel
+        style.configure('Queue.Treeview', background=colors['bg_secondary'], fieldbackground=colors['bg_secondary'],
+                        foreground=colors['fg'], rowheight=20, font=('Arial', 9))
+        style.map('Queue.Treeview', background=[('selected', colors['button'])])
+        style.configure('Queue.Treeview.Heading', background=colors['button'], foreground=colors['button_fg'],
+                        relief='flat', font=('Arial', 9, 'bold'))
+
         style.configure('ChoiceSelected.TRadiobutton', background=colors['selected_bg'], foreground=colors['selected_fg'],
                         padding=[10, 5], font=('Arial', 10, 'bold'))
         style.map('ChoiceSelected.TRadiobutton',
@@ -195,13 +404,34 @@ class YTDLPGUI:
         ttk.Checkbutton(opts, text="Встраивать субтитры", variable=self.opt_embed_subs).pack(side=tk.LEFT, padx=5)
         ttk.Checkbutton(opts, text="Сохр. исходные (-k)", variable=self.opt_keep_temp).pack(side=tk.LEFT, padx=5)
         ttk.Checkbutton(opts, text="Открыть папку после очереди", variable=self.opt_open_after_queue).pack(side=tk.LEFT, padx=5)
+        if inprocess_available():
+            ttk.Checkbutton(opts, text="Встроенный yt-dlp", variable=self.opt_inprocess).pack(side=tk.LEFT, padx=5)
 
         net = tk.Frame(main, bg=colors['bg'])
         net.grid(row=2, column=0, columnspan=3, sticky='ew', pady=(6, 0))
         tk.Label(net, text="Потоков (-N):", bg=colors['bg'], fg=colors['fg']).pack(side=tk.LEFT)
         ttk.Spinbox(net, from_=1, to=32, textvariable=self.net_threads, width=4).pack(side=tk.LEFT, padx=5)
+        ttk.Checkbutton(net, text="авто", variable=self.opt_auto_threads).pack(side=tk.LEFT)
+        ttk.Checkbutton(net, text="aria2c", variable=self.opt_aria2).pack(side=tk.LEFT, padx=(10, 0))
+        tk.Label(net, text="-x", bg=colors['bg'], fg=colors['fg']).pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Spinbox(net, from_=1, to=16, textvariable=self.aria2_connections, width=3).pack(side=tk.LEFT, padx=2)
+        tk.Label(net, text="-s", bg=colors['bg'], fg=colors['fg']).pack(side=tk.LEFT)
+        ttk.Spinbox(net, from_=1, to=64, textvariable=self.aria2_split, width=3).pack(side=tk.LEFT, padx=2)
         tk.Label(net, text="Лимит скорости (напр. 5M):", bg=colors['bg'], fg=colors['fg']).pack(side=tk.LEFT, padx=(10, 0))
         ttk.Entry(net, textvariable=self.limit_rate, width=10).pack(side=tk.LEFT, padx=5)
+        tk.Label(net, text="Общий лимит:", bg=colors['bg'], fg=colors['fg']).pack(side=tk.LEFT, padx=(10, 0))
+        total_entry = ttk.Entry(net, textvariable=self.total_rate, width=10)
+        total_entry.pack(side=tk.LEFT, padx=5)
+        # applied when editing is done, not on every keystroke
+        total_entry.bind('<Return>', self._apply_total_rate)
+        total_entry.bind('<FocusOut>', self._apply_total_rate)
+        tk.Label(net, text="Параллельно:", bg=colors['bg'], fg=colors['fg']).pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Spinbox(net, from_=1, to=MAX_PARALLEL_LIMIT, textvariable=self.max_parallel, width=4).pack(side=tk.LEFT, padx=5)
+        tk.Label(net, text="С одного сайта:", bg=colors['bg'], fg=colors['fg']).pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Spinbox(net, from_=0, to=MAX_PARALLEL_LIMIT, textvariable=self.host_limit, width=4).pack(side=tk.LEFT, padx=5)
+        tk.Label(net, text="Пакет:", bg=colors['bg'], fg=colors['fg']).pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Spinbox(net, from_=1, to=MAX_BATCH_ITEMS, textvariable=self.batch_items, width=4).pack(side=tk.LEFT, padx=5)
+        ttk.Checkbutton(net, text="Сначала короткие", variable=self.opt_sjf).pack(side=tk.LEFT, padx=(10, 0))
 
         # --- Formats grid ---
         formats_frame = tk.Frame(main, bg=colors['bg'], pady=10)
@@ -210,8 +440,9 @@ class YTDLPGUI:
         self.format_buttons: list[ttk.Radiobutton] = []
         formats_data: list[tuple[str, str]] = []
         for category, options in FORMAT_OPTIONS.items():
-            for text, fmt in options.items():
-                formats_data.append((f"{category} - {text}", fmt))
+            for text in options:
+                # the preset name is the value: several audio presets share one -f expression
+                formats_data.append((f"{category} - {text}", f"{category} - {text}"))
 
         def sort_key(item_tuple):
             text = item_tuple[0]
@@ -239,6 +470,7 @@ class YTDLPGUI:
         default_value = next((v for t, v in formats_data if '1080p' in t), formats_data[0][1])
         self.selected_format_var.set(self._load_last_format(default_value))
 
+        self.format_names: dict[str, str] = {}  # preset -> button text without the probe result
         for i, (text, value) in enumerate(formats_data):
             display = " - ".join(text.split(' - ')[1:])
             rb = ttk.Radiobutton(formats_frame, text=display, variable=self.selected_format_var,
@@ -246,7 +478,9 @@ class YTDLPGUI:
                                  command=self._update_format_styles)
             rb.grid(row=i // 3, column=i % 3, sticky='we', padx=5, pady=2)
             self.format_buttons.append(rb)
+            self.format_names[value] = display
         self._update_format_styles()
+        self.url_var.trace_add('write', self._on_url_changed)
 
         # --- Queue & Log ---
         queue_frame = tk.Frame(main, bg=colors['bg'], pady=5)
@@ -256,20 +490,35 @@ class YTDLPGUI:
         buttons_row = tk.Frame(queue_frame, bg=colors['bg'])
         buttons_row.grid(row=0, column=0, columnspan=3, sticky='ew')
         self._button(buttons_row, "Добавить в очередь 🔽", self.add_to_queue).pack(side=tk.LEFT, padx=5, pady=5)
+        self._button(buttons_row, "Импорт…", self.import_urls).pack(side=tk.LEFT, padx=5, pady=5)
         self._button(buttons_row, "Очистить очередь", self.clear_queue).pack(side=tk.LEFT, padx=5, pady=5)
-        self._button(buttons_row, "⏹ Стоп", self.stop_current).pack(side=tk.RIGHT, padx=5, pady=5)
+        self._button(buttons_row, "📄 Логи", self.show_item_logs).pack(side=tk.LEFT, padx=5, pady=5)
+        self._button(buttons_row, "Сбойные → файл", self.export_failed).pack(side=tk.LEFT, padx=5, pady=5)
+        self.stats_var = tk.StringVar(value="")
+        tk.Label(buttons_row, textvariable=self.stats_var, bg=colors['bg'], fg=colors['fg'],
+                 font=('Arial', 9)).pack(side=tk.LEFT, padx=5)
+        self._button(buttons_row, "⏹ Стоп", self.stop_all).pack(side=tk.RIGHT, padx=5, pady=5)
         ttk.Button(buttons_row, text="🚀 СТАРТ", command=self.start_queue_download, style='Accent.Rounded.TButton').pack(side=tk.RIGHT, padx=5, pady=5)
 
-        # Progressbar
+        # Progressbar (whole queue: finished items / total)
         self.progress = ttk.Progressbar(queue_frame, orient='horizontal', mode='determinate', length=400)
         self.progress.grid(row=1, column=0, columnspan=3, sticky='ew', pady=(0, 6))
 
+        # Every item of the run: running, pending (drag to reorder), finished
+        self.queue_view = QueueView(queue_frame, self.engine)
+        self.queue_view.frame.grid(row=2, column=0, columnspan=3, sticky='ew')
+        view_buttons = tk.Frame(self.queue_view.frame, bg=colors['bg'])
+        view_buttons.grid(row=1, column=0, columnspan=2, sticky='ew', pady=(2, 6))
+        self._button(view_buttons, "Приоритет +", lambda: self._bump_priority(1)).pack(side=tk.LEFT, padx=(0, 5))
+        self._button(view_buttons, "Приоритет −", lambda: self._bump_priority(-1)).pack(side=tk.LEFT, padx=5)
+        self._button(view_buttons, "⏹ Выбранное", self.stop_selected).pack(side=tk.LEFT, padx=5)
+
         # Log widget + scrollbar
         self.log_text_widget = tk.Text(queue_frame, height=12, bg=colors['bg_secondary'], fg=colors['fg'],
                                        bd=1, relief=tk.FLAT, highlightthickness=0, wrap=tk.WORD, font=('Courier', 9))
-        self.log_text_widget.grid(row=2, column=0, columnspan=2, sticky='nsew')
+        self.log_text_widget.grid(row=3, column=0, columnspan=2, sticky='nsew')
         scroll = ttk.Scrollbar(queue_frame, command=self.log_text_widget.yview)
-        scroll.grid(row=2, column=2, sticky='ns')
+        scroll.grid(row=3, column=2, sticky='ns')
         self.log_text_widget.configure(yscrollcommand=scroll.set)
 
         # Tags
@@ -318,69 +567,143 @@ class YTDLPGUI:
         # persist selection
         self._save_last_format(sel)
 
+    # ---------- Format probe ----------
+    def _on_url_changed(self, *_args):
+        # probe once typing/pasting has settled
+        if self._probe_job is not None:
+            self.master.after_cancel(self._probe_job)
+        self._probe_job = self.master.after(FORMAT_PROBE_DELAY_MS, self._probe_url)
+
+    def _probe_url(self):
+        self._probe_job = None
+        url = self.url_var.get().strip()
+        self._show_format_matches(None)
+        if url.startswith(('http://', 'https://')) and len(url.split()) == 1:
+            self.engine.probe_formats(url)
+
+    def _on_formats(self, url: str, info: dict | Exception):
+        if url != self.url_var.get().strip():
+            return  # the URL changed while yt-dlp was busy
+        if isinstance(info, Exception):
+            self._log(f"Не удалось получить форматы: {info}\n", 'error')
+            info = None
+        self._show_format_matches(info)
+
+    def _show_format_matches(self, info: dict | None):
+        """Label each preset with its expected size, or disable it if the video lacks it."""
+        self._format_matches = {}
+        formats = info.get('formats') if info else None
+        for rb in self.format_buttons:
+            preset = rb.cget('value')
+            text = self.format_names[preset]
+            picks = match_format(find_format(preset), formats) if formats else None
+            if picks is not None:
+                self._format_matches[preset] = bool(picks)
+                size = estimate_size(picks, info.get('duration')) if picks else None
+                text += f" · {format_bytes(size)}" if size else " · ?" if picks else " · нет"
+            try:
+                rb.configure(text=text)
+                rb.state(['disabled'] if picks == [] else ['!disabled'])
+            except tk.TclError:
+                pass
+
     # ---------- Settings ----------
-    def _settings_path(self) -> Path:
-        return CONFIG_FILE
+    def _option_vars(self) -> dict[str, tk.Variable]:
+        return {
+            'playlist_all': self.opt_playlist_all,
+            'open_after_queue': self.opt_open_after_queue,
+            'embed_thumbnail': self.opt_embed_thumbnail,
+            'embed_subs': self.opt_embed_subs,
+            'keep_temp': self.opt_keep_temp,
+            'inprocess': self.opt_inprocess,
+            'net_threads': self.net_threads,
+            'auto_threads': self.opt_auto_threads,
+            'aria2': self.opt_aria2,
+            'aria2_connections': self.aria2_connections,
+            'aria2_split': self.aria2_split,
+            'limit_rate': self.limit_rate,
+            'total_rate': self.total_rate,
+            'max_parallel': self.max_parallel,
+            'host_limit': self.host_limit,
+            'sjf': self.opt_sjf,
+            'batch_items': self.batch_items,
+        }
 
     def _load_settings(self):
-        cfg_path = self._settings_path()
-        try:
-            with open(cfg_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            data = {}
-        self.download_path.set(data.get('download_path', DEFAULT_DOWNLOAD_DIR))
-        self.subfolder_var.set(data.get('subfolder', 'yt-dlp_downloads'))
-
-    def _save_settings(self):
-        cfg_path = self._settings_path()
-        data = {
+        self.settings = SettingsStore()
+        self.download_path.set(self.settings.get('download_path', DEFAULT_DOWNLOAD_DIR))
+        self.subfolder_var.set(self.settings.get('subfolder', DEFAULT_SUBFOLDER))
+        opts = self.settings.get('opts')
+        if isinstance(opts, dict):
+            for key, var in self._option_vars().items():
+                if key in opts:
+                    try:
+                        var.set(opts[key])
+                    except tk.TclError:
+                        pass
+
+    def _save_settings(self, immediate: bool = False):
+        """Copy the UI state into the settings store; the disk write is debounced."""
+        opts = {}
+        for key, var in self._option_vars().items():
+            try:
+                opts[key] = var.get()
+            except tk.TclError:  # half-typed spinbox value
+                opts[key] = (self.settings.get('opts') or {}).get(key)
+        opts['max_parallel'] = self._parallel_limit()
+        self.settings.update({
             'download_path': self.download_path.get(),
             'subfolder': self.subfolder_var.get(),
             'last_format': self.selected_format_var.get(),
-            'opts': {
-                'playlist_all': self.opt_playlist_all.get(),
-                'open_after_queue': self.opt_open_after_queue.get(),
-                'embed_thumbnail': self.opt_embed_thumbnail.get(),
-                'embed_subs': self.opt_embed_subs.get(),
-                'keep_temp': self.opt_keep_temp.get(),
-                'net_threads': self.net_threads.get(),
-                'limit_rate': self.limit_rate.get(),
-            }
-        }
+            'opts': opts,
+        })
+        if immediate:
+            self._flush_settings()
+        else:
+            self._schedule_settings_save()
+
+    def _schedule_settings_save(self):
+        # one pending write at a time; clicks within the delay are coalesced
+        if self.settings.dirty and self._settings_save_job is None:
+            self._settings_save_job = self.master.after(SETTINGS_SAVE_DELAY_MS, self._flush_settings)
+
+    def _flush_settings(self):
+        if self._settings_save_job is not None:
+            try:
+                self.master.after_cancel(self._settings_save_job)
+            except tk.TclError:
+                pass
+            self._settings_save_job = None
         try:
-            with open(cfg_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            self.settings.save()
         except Exception as e:
             print(f"Ошибка сохранения настроек: {e}")
 
     def _load_last_format(self, default_val: str) -> str:
-        try:
-            with open(self._settings_path(), 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            return data.get('last_format', default_val)
-        except Exception:
-            return default_val
+        last = self.settings.get('last_format', default_val)
+        # older versions saved the -f expression itself
+        for category, options in FORMAT_OPTIONS.items():
+            for text, fmt in options.items():
+                if last in (f"{category} - {text}", fmt):
+                    return f"{category} - {text}"
+        return default_val
 
     def _save_last_format(self, fmt: str):
-        # merge-save
-        try:
-            cfg = {}
-            p = self._settings_path()
-            if p.exists():
-                with open(p, 'r', encoding='utf-8') as f:
-                    cfg = json.load(f)
-            cfg['last_format'] = fmt
-            with open(p, 'w', encoding='utf-8') as f:
-                json.dump(cfg, f, ensure_ascii=False, indent=2)
-        except Exception:
-            pass
+        self.settings.update({'last_format': fmt})
+        self._schedule_settings_save()
 
     # ---------- Handlers ----------
     def on_closing(self):
-        self._save_settings()
+        self._save_settings(immediate=True)
+        # running items stay 'running' in the journal and resume on next start
+        self.engine.shutdown()
         self.master.destroy()
 
+    def _restore_queue(self):
+        if self.engine.restore():
+            # the previous session was downloading; carry on where it stopped
+            self.master.after(0, self.start_queue_download)
+
     def choose_dir(self):
         initial = self.download_path.get() if os.path.exists(self.download_path.get()) else os.path.expanduser('~')
         new_dir = filedialog.askdirectory(initialdir=initial, title="Выберите папку для сохранения")
@@ -395,94 +718,141 @@ class YTDLPGUI:
             pass
 
     def clear_queue(self):
-        self.download_queue.clear()
-        self._log("Очередь очищена\n", 'queue')
+        self.engine.clear()
 
     def add_to_queue(self):
         url = self.url_var.get().strip()
-        fmt = self.selected_format_var.get().strip()
+        preset = self.selected_format_var.get().strip()
         if not url:
             messagebox.showerror("Ошибка ввода", "Введите URL для загрузки.")
             return
-        if not fmt:
+        if not preset:
             messagebox.showerror("Ошибка формата", "Выберите формат загрузки.")
             return
+        if self._format_matches.get(preset) is False:
+            messagebox.showerror("Ошибка формата", f"У этого видео нет форматов для «{self.format_names[preset]}».")
+            return
 
-        # build output dir
-        subfolder = sanitize_subfolder(self.subfolder_var.get())
-        final_dir = os.path.join(self.download_path.get(), subfolder)
-        os.makedirs(final_dir, exist_ok=True)
-
-        # build command
-        cmd = [YTDLP_BIN, '-v', '-N', str(self.net_threads.get()), '-f', fmt]
-
-        # apply options
-        if self.opt_keep_temp.get():
-            cmd.append('-k')
-        if self.opt_embed_thumbnail.get():
-            cmd.extend(['--embed-thumbnail'])
-        if self.opt_embed_subs.get():
-            cmd.extend(['--embed-subs'])
-        if self.opt_playlist_all.get():
-            cmd.append('--yes-playlist')
+        self.url_var.set("")
+        self._save_settings()
+        if len(url.split()) > 1:
+            # a multi-line paste: same path as a file import
+            self.engine.import_urls(url, self._download_options(preset), self._final_dir())
         else:
-            cmd.append('--no-playlist')
-        if self.limit_rate.get().strip():
-            cmd.extend(['--limit-rate', self.limit_rate.get().strip()])
+            self.engine.add_url(url, self._download_options(preset), self._final_dir())
 
-        # platform-specific filename policy
-        if sys.platform.startswith('win'):
-            cmd.append('--windows-filenames')
-
-        # output template
-        out_tmpl = os.path.join(final_dir, '%(title).180B [%(id)s].%(ext)s')
-        cmd.extend(['-o', out_tmpl])
-
-        cmd.append(url)
-
-        self.download_queue.append((url, cmd, final_dir))
-        self._log(f"Добавлено в очередь: {url}\n", 'queue')
-        self.url_var.set("")
+    def import_urls(self):
+        """Queue every URL from a text/CSV file with the current format and options."""
+        preset = self.selected_format_var.get().strip()
+        if not preset:
+            messagebox.showerror("Ошибка формата", "Выберите формат загрузки.")
+            return
+        path = filedialog.askopenfilename(title="Импорт ссылок",
+                                          filetypes=[("Текст и CSV", '*.txt *.csv'), ("Все файлы", '*')])
+        if not path:
+            return
+        try:
+            with open(path, 'r', encoding='utf-8-sig', errors='replace') as f:
+                text = f.read()
+        except OSError as e:
+            messagebox.showerror("Ошибка", f"Не удалось прочитать файл:\n{e}")
+            return
         self._save_settings()
+        self._log(f"Импорт из {path}...\n", 'queue')
+        self.engine.import_urls(text, self._download_options(preset), self._final_dir())
+
+    def _final_dir(self) -> str:
+        return os.path.join(self.download_path.get(), sanitize_subfolder(self.subfolder_var.get()))
+
+    def _download_options(self, preset: str) -> DownloadOptions:
+        return DownloadOptions.from_preset(
+            preset,
+            net_threads=self.net_threads.get(),
+            limit_rate=self.limit_rate.get(),
+            keep_temp=self.opt_keep_temp.get(),
+            embed_thumbnail=self.opt_embed_thumbnail.get(),
+            embed_subs=self.opt_embed_subs.get(),
+            playlist_all=self.opt_playlist_all.get(),
+            aria2=self.opt_aria2.get(),
+            aria2_connections=self.aria2_connections.get(),
+            aria2_split=self.aria2_split.get(),
+        )
 
     def start_queue_download(self):
-        if self.is_downloading:
+        if self.engine.running:
             messagebox.showwarning("Загрузка", "Загрузка уже идет.")
             return
-        if not self.download_queue:
+        if not self.engine.queue and not self.engine.pending_resolves:
             messagebox.showinfo("Очередь", "Очередь загрузки пуста.")
             return
-        self.is_downloading = True
         self.progress['value'] = 0
-        self._log("\n--- ЗАПУСК ОЧЕРЕДИ ---\n", 'info')
-        self._process_queue()
+        self.queue_view.reset()
+        self.engine.backend = BACKEND_INPROCESS if self.opt_inprocess.get() else BACKEND_SUBPROCESS
+        self._apply_total_rate()
+        self.engine.start()
 
-    def stop_current(self):
-        proc = self.current_process
-        if proc and proc.poll() is None:
-            try:
-                proc.terminate()
-            except Exception:
-                try:
-                    proc.kill()
-                except Exception:
-                    pass
-            self._log("\n--- ОСТАНОВЛЕНО ПОЛЬЗОВАТЕЛЕМ ---\n", 'error')
-
-    def _process_queue(self):
-        if not self.download_queue:
-            self.is_downloading = False
-            self._log("\n--- ОЧЕРЕДЬ ЗАВЕРШЕНА ---\n", 'info')
-            if self.opt_open_after_queue.get() and self._last_output_dir:
-                self._open_folder(self._last_output_dir)
-            messagebox.showinfo("Завершено", "Вся очередь загружена!")
+    def stop_all(self):
+        """Stop every running worker and pause the queue (pending items are kept)."""
+        self.engine.stop_all()
+
+    def _parallel_limit(self) -> int:
+        try:
+            n = int(self.max_parallel.get())
+        except (tk.TclError, ValueError):
+            n = DEFAULT_MAX_PARALLEL
+        return max(1, min(MAX_PARALLEL_LIMIT, n))
+
+    def _on_parallel_changed(self, *_args):
+        # takes effect at the next free slot; running workers are not touched
+        self.engine.max_parallel = self._parallel_limit()
+        try:
+            self.engine.host_limit = max(0, int(self.host_limit.get()))
+            self.engine.batch_items = max(1, min(MAX_BATCH_ITEMS, int(self.batch_items.get())))
+        except (tk.TclError, ValueError):
+            pass  # half-typed value
+
+    def _apply_total_rate(self, _event=None):
+        rate = parse_rate(self.total_rate.get())
+        if rate != self.engine.total_rate:
+            self.engine.set_total_rate(rate)
+            self._save_settings()
+
+    def _on_auto_threads_changed(self, *_args):
+        # applies to items started from now on
+        self.engine.auto_threads = self.opt_auto_threads.get()
+
+    def _on_sjf_changed(self, *_args):
+        self.engine.set_sjf(self.opt_sjf.get())
+        self._save_settings()
+
+    def _on_queue_finished(self, stopped: bool):
+        if stopped:
             return
+        if self.opt_open_after_queue.get() and self.engine.last_output_dir:
+            self._open_folder(self.engine.last_output_dir)
+        messagebox.showinfo("Завершено", "Вся очередь загружена!")
+
+    def _on_job_started(self, job: DownloadJob):
+        self.queue_view.job_started(job)
+
+    def _on_job_finished(self, job: DownloadJob):
+        self.queue_view.job_finished(job)
+        self._update_total_progress()
+
+    def _bump_priority(self, delta: int):
+        item = self.queue_view.selected_pending()
+        if item is not None:
+            self.engine.set_priority(item.item_id, item.priority + delta)
+            self.queue_view.refresh(force=True)
 
-        url, command, final_dir = self.download_queue.pop(0)
-        self._last_output_dir = final_dir
-        self._log(f"\n--- Загрузка: {url} ---\n", 'info')
-        self._log(f"Команда: {' '.join(command)}\n")
-        threading.Thread(target=self._execute_download, args=(command, final_dir), daemon=True).start()
+    def stop_selected(self):
+        job = self.queue_view.selected_job()
+        if job is not None:
+            self.engine.stop_job(job.job_id)
+
+    def _update_total_progress(self):
+        total = max(1, self.engine.total)
+        self.progress['value'] = 100.0 * self.engine.done / total
 
     def _open_folder(self, path):
         try:
@@ -495,101 +865,150 @@ class YTDLPGUI:
         except Exception as e:
             print(f"Не удалось открыть папку: {e}")
 
-    def _execute_download(self, command, final_dir):
+    def _drain_output(self):
+        """UI tick: let the engine flush output and reap jobs, then repaint progress and the queue panel."""
+        self.engine.pump()
+        now = time.monotonic()
+        if (self.engine.active or self.engine.post_active) and now - self._last_progress_paint >= PROGRESS_MIN_INTERVAL:
+            self._last_progress_paint = now
+            total_speed = sum(job.speed for job in self.engine.active.values())
+            post = f" · обработка: {len(self.engine.post_active)}" if self.engine.post_active else ''
+            self.stats_var.set(f"Активно: {len(self.engine.active)}{post} · {format_bytes(total_speed)}/s")
+            self._update_total_progress()  # late additions change the total
+        self.queue_view.refresh()
         try:
-            startupinfo = None
-            if sys.platform.startswith('win'):
-                startupinfo = subprocess.STARTUPINFO()
-                startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-
-            self.current_process = subprocess.Popen(
-                command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1,
-                encoding='utf-8',
-                errors='replace',
-                startupinfo=startupinfo
-            )
-
-            for raw in iter(self.current_process.stdout.readline, ''):
-                if raw is None:
-                    break
-                line = raw.replace('\r', '')  # yt-dlp uses carriage returns
-                self.master.after(0, self._handle_output_line, line)
-
-            self.current_process.wait()
-            rc = self.current_process.returncode
-            self.master.after(0, self._on_single_finish, rc, final_dir)
-        except FileNotFoundError:
-            self.master.after(0, messagebox.showerror, "Критическая ошибка", f"'{YTDLP_BIN}' не найден. Убедитесь, что yt-dlp в PATH.")
-            self.master.after(0, self._on_single_finish, -1, None)
-        except Exception as e:
-            self.master.after(0, messagebox.showerror, "Критическая ошибка", f"Ошибка выполнения: {e}")
-            self.master.after(0, self._on_single_finish, -1, None)
-        finally:
-            self.current_process = None
-
-    def _handle_output_line(self, line: str):
-        # progress parse
-        if '[download]' in line:
-            # match 12.3% or 12%
-            m = re.search(r'(\d{1,3}(?:\.\d+)?)%', line)
-            if m:
-                try:
-                    val = float(m.group(1))
-                    self.progress['value'] = max(0.0, min(100.0, val))
-                except ValueError:
-                    pass
-            self._log(line, 'download')
-        elif any(tag in line for tag in ('[Merger]', '[ExtractAudio]', '[ffmpeg]')):
-            self._log(line, 'process')
-        else:
-            self._log(line)
-
-    def _on_single_finish(self, return_code: int, final_dir: str | None):
-        self.progress['value'] = 0
-        if return_code == 0:
-            self._log("\n--- УСПЕХ ---\n", 'success')
-        else:
-            self._log(f"\n--- ОШИБКА: Код {return_code} ---\n", 'error')
-        self.master.after(300, self._process_queue)
+            self.master.after(OUTPUT_FLUSH_MS, self._drain_output)
+        except tk.TclError:
+            pass  # window is gone
 
     def _log(self, text: str, tag: str | None = None):
+        self._log_batch([(text, tag or '')])
+
+    def _log_batch(self, lines: list[tuple[str, str]]):
+        """Append many (text, tag) pairs with a single Text.insert call."""
         if not hasattr(self, 'log_text_widget') or not self.log_text_widget.winfo_exists():
             return
-        try:
-            self.log_text_widget.configure(state='normal')
-            if tag:
-                self.log_text_widget.insert(tk.END, text, tag)
+        # merge runs with the same tag, then pass text/tag pairs to one insert
+        runs: list[tuple[str, list[str]]] = []
+        for text, tag in lines:
+            if runs and runs[-1][0] == tag:
+                runs[-1][1].append(text)
             else:
-                self.log_text_widget.insert(tk.END, text)
-            self.log_text_widget.see(tk.END)
-            self.log_text_widget.configure(state='disabled')
+                runs.append((tag, [text]))
+        args: list[str] = []
+        for tag, texts in runs:
+            args.extend((''.join(texts), tag))
+        widget = self.log_text_widget
+        try:
+            # follow the tail only if the user hasn't scrolled up
+            follow = widget.yview()[1] >= 0.999
+            widget.configure(state='normal')
+            widget.insert(tk.END, *args)
+            # ring buffer: drop the oldest lines beyond LOG_MAX_LINES
+            excess = int(widget.index('end-1c').split('.')[0]) - LOG_MAX_LINES
+            if excess > 0:
+                widget.delete('1.0', f'{excess + 1}.0')
+            if follow:
+                widget.see(tk.END)
+            widget.configure(state='disabled')
         except tk.TclError:
             pass
 
+    # ---------- Item logs ----------
+    def export_failed(self):
+        """Save URLs that failed for good (after all retries) for a later re-run."""
+        items = self.engine.failed_items
+        if not items:
+            messagebox.showinfo("Сбойные загрузки", "Нет окончательно сбойных загрузок.")
+            return
+        path = filedialog.asksaveasfilename(title="Сохранить список ссылок", defaultextension='.txt',
+                                            initialfile='failed.txt', filetypes=[("Текст", '*.txt')])
+        if not path:
+            return
+        try:
+            write_url_file(path, [item.url for item in items])
+        except OSError as e:
+            messagebox.showerror("Ошибка", f"Не удалось сохранить файл:\n{e}")
+            return
+        self._log(f"Сбойные ссылки ({len(items)}) сохранены: {path}\n", 'info')
+
+    def show_item_logs(self):
+        """List finished items; double-click opens the item's full log file."""
+        if not self.engine.finished:
+            messagebox.showinfo("Логи", "Нет завершённых загрузок.")
+            return
+        win = tk.Toplevel(self.master, bg=colors['bg'])
+        win.title("Логи загрузок")
+        lb = tk.Listbox(win, width=100, height=15, bg=colors['bg_secondary'], fg=colors['fg'],
+                        selectbackground=colors['selected_bg'], highlightthickness=0, font=('Courier', 9))
+        lb.pack(fill='both', expand=True, padx=10, pady=10)
+        jobs = list(reversed(self.engine.finished))
+        for job in jobs:
+            status = 'OK ' if job.return_code == 0 else f'E{job.return_code}'
+            lb.insert(tk.END, f"#{job.job_id:<4} {status:<4} {job.url}")
+
+        def open_selected(_event=None):
+            sel = lb.curselection()
+            if sel:
+                self._open_item_log(jobs[sel[0]])
+        lb.bind('<Double-Button-1>', open_selected)
+        lb.bind('<Return>', open_selected)
+
+    def _open_item_log(self, job: DownloadJob):
+        path = job.log_path
+        if not path or not path.exists():
+            messagebox.showerror("Логи", "Лог-файл не найден (возможно, удалён при очистке).")
+            return
+        win = tk.Toplevel(self.master, bg=colors['bg'])
+        win.title(f"#{job.job_id} — {path.name}")
+        text = tk.Text(win, width=120, height=30, bg=colors['bg_secondary'], fg=colors['fg'],
+                       wrap=tk.NONE, font=('Courier', 9))
+        scroll = ttk.Scrollbar(win, command=text.yview)
+        text.configure(yscrollcommand=scroll.set)
+        scroll.pack(side=tk.RIGHT, fill='y')
+        text.pack(fill='both', expand=True)
+        try:
+            f = open(path, 'r', encoding='utf-8', errors='replace')
+        except OSError as e:
+            text.insert(tk.END, f"Ошибка чтения: {e}\n")
+            return
+
+        # the file is read in chunks between UI ticks, so big logs don't freeze the window
+        def load_chunk():
+            try:
+                if not text.winfo_exists():
+                    f.close()
+                    return
+                chunk = f.read(LOG_VIEW_CHUNK)
+                if chunk:
+                    text.insert(tk.END, chunk)
+                    win.after(1, load_chunk)
+                else:
+                    f.close()
+                    text.configure(state='disabled')
+            except (OSError, tk.TclError):
+                f.close()
+        load_chunk()
+
     # ---------- Deps check ----------
     def _check_binaries_silent(self):
-        def have(cmd):
+        """Probe yt-dlp/ffmpeg in the background; the window shows up right away."""
+        def run():
+            results = probe_binaries([YTDLP_BIN, 'ffmpeg', 'aria2c'])
             try:
-                subprocess.run([cmd, '--version'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                return True
-            except Exception:
-                return False
-        if not have(YTDLP_BIN):
+                self.master.after(0, self._report_binaries, results)
+            except (RuntimeError, tk.TclError):
+                pass  # window closed before the probe finished
+        threading.Thread(target=run, daemon=True).start()
+
+    def _report_binaries(self, results: dict[str, str | None]):
+        if results.get(YTDLP_BIN) is None:
             self._log("ВНИМАНИЕ: yt-dlp не найден в PATH. Установите yt-dlp.\n", 'error')
         # ffmpeg is optional but recommended
-        if not have('ffmpeg'):
+        if results.get('ffmpeg') is None:
             self._log("ВНИМАНИЕ: ffmpeg не найден. Некоторые операции могут не работать.\n", 'error')
-
-# ---------- Utilities ----------
-def sanitize_subfolder(name: str) -> str:
-    name = (name or '').strip() or 'yt-dlp_downloads'
-    # Windows forbidden characters
-    forbidden = r'<>:"/\\|?*'
-    return ''.join(ch for ch in name if ch not in forbidden)
+        if results.get('aria2c') is None and self.opt_aria2.get():
+            self._log("ВНИМАНИЕ: aria2c не найден, загрузка пойдёт встроенным загрузчиком yt-dlp.\n", 'error')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,3001 @@
+"""Download queue engine shared by the GUI (final.py) and headless runs.
+
+Nothing here imports tkinter: command building from FORMAT_OPTIONS, the
+journaled queue, the worker pool and progress parsing all live in this
+module. Run it directly for a headless queue:
+
+    python -m ytdlp_engine -i urls.txt -f 1080p -j 4
+    some-exporter | python -m ytdlp_engine -f "MP3 (192kbps)"
+"""
+import argparse
+import functools
+import hashlib
+import heapq
+import importlib.util
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+# ==========================
+#  CONFIG & CONSTANTS
+# ==========================
+APP_NAME = "yt-dlp-gui"
+YTDLP_BIN = os.environ.get('YTDLP_BIN') or "yt-dlp"  # e.g. bench/fake_ytdlp.py for benchmarks
+DEFAULT_DOWNLOAD_DIR = os.path.join(os.path.expanduser('~'), 'Downloads')
+DEFAULT_SUBFOLDER = 'yt-dlp_downloads'
+DEFAULT_MAX_PARALLEL = 2  # yt-dlp processes in flight
+MAX_PARALLEL_LIMIT = 8
+LOG_FILE_MAX_BYTES = 20 * 1024 * 1024  # per item, rolled over to <name>.1
+LOG_KEEP_FILES = 200  # item logs kept in LOGS_DIR
+CLI_TICK = 0.1  # seconds between pump() calls in headless mode
+CLI_STATUS_INTERVAL = 5.0  # seconds between status lines in headless mode
+BACKEND_SUBPROCESS = 'subprocess'  # one yt-dlp process per item
+BACKEND_INPROCESS = 'inprocess'  # yt_dlp.YoutubeDL in warm worker processes
+INPROCESS_PROGRESS_INTERVAL = 0.1  # seconds between progress messages from a worker
+RATE_MIN = 16 * 1024  # bytes/s floor for one job's share of the total budget
+
+# Machine-readable progress: one "[progress] <video id> <json>" line per event
+PROGRESS_PREFIX = '[progress] '
+PROGRESS_FIELDS = ('status', 'downloaded_bytes', 'total_bytes', 'total_bytes_estimate',
+                   'speed', 'eta', 'elapsed', 'fragment_index', 'fragment_count')
+PROGRESS_TEMPLATE = 'download:' + PROGRESS_PREFIX + '%(info.id)s %(progress.{' + ','.join(PROGRESS_FIELDS) + '})j'
+
+# Format presets: (label -> yt-dlp -f expression)
+FORMAT_OPTIONS = {
+    'Видео (WebM)': {
+        '144p': 'bv*[ext=webm][height<=144]+ba*[ext=webm]',
+        '240p': 'bv*[ext=webm][height<=240]+ba*[ext=webm]',
+        '360p': 'bv*[ext=webm][height<=360]+ba*[ext=webm]',
+        '480p': 'bv*[ext=webm][height<=480]+ba*[ext=webm]',
+        '720p': 'bv*[ext=webm][height<=720]+ba*[ext=webm]',
+        '1080p': 'bv*[ext=webm][height<=1080]+ba*[ext=webm]',
+    },
+    'Видео (MP4/AVC)': {
+        '1080p (MP4)': 'bv*[vcodec*=avc1][height<=1080]+ba[ext=m4a]/bv*[ext=mp4][height<=1080]+ba[ext=m4a]'
+    },
+    'High Res (WebM)': {
+        '2K (1440p)': 'bv*[ext=webm][height<=1440]+ba*[ext=webm]',
+        '4K (2160p)': 'bv*[ext=webm][height<=2160]+ba*[ext=webm]',
+        '8K (4320p)': 'bv*[ext=webm][height<=4320]+ba*[ext=webm]',
+    },
+    'Аудио': {
+        'MP3 (192kbps)': 'ba/bestaudio',
+        'M4A (AAC)': 'ba*[ext=m4a]/bestaudio[ext=m4a]',
+        'OPUS (Lossy)': 'ba/bestaudio',
+        'WAV (Uncompressed)': 'ba/bestaudio',
+        'FLAC (Lossless)': 'ba/bestaudio',
+    }
+}
+# audio presets that are transcoded after the download: label -> (--audio-format, --audio-quality)
+AUDIO_CONVERT = {
+    'MP3 (192kbps)': ('mp3', '192K'),
+    'OPUS (Lossy)': ('opus', ''),
+    'WAV (Uncompressed)': ('wav', ''),
+    'FLAC (Lossless)': ('flac', ''),
+}
+
+# ==========================
+#  Helpers
+# ==========================
+
+def platform_config_dir() -> Path:
+    """Return per-OS config dir."""
+    if sys.platform.startswith('win'):
+        base = os.environ.get('APPDATA') or os.path.expanduser('~')
+        return Path(base) / APP_NAME
+    elif sys.platform == 'darwin':
+        return Path.home() / 'Library' / 'Application Support' / APP_NAME
+    else:
+        return Path.home() / '.config' / APP_NAME
+
+CONFIG_DIR = platform_config_dir()
+CONFIG_DIR.mkdir(parents=True, exist_ok=True)
+CONFIG_FILE = CONFIG_DIR / 'config.json'
+LOGS_DIR = CONFIG_DIR / 'logs'
+LOGS_DIR.mkdir(exist_ok=True)
+QUEUE_DB = CONFIG_DIR / 'queue.sqlite3'
+PROBE_CACHE_FILE = CONFIG_DIR / 'probe_cache.json'
+PLAYLIST_CACHE_FILE = CONFIG_DIR / 'playlist_cache.json'
+PLAYLIST_CACHE_TTL = 6 * 3600  # seconds a resolved playlist is reused
+PLAYLIST_CACHE_MAX = 200  # playlists kept in the cache file
+FORMAT_CACHE_FILE = CONFIG_DIR / 'format_cache.json'
+FORMAT_CACHE_TTL = 3600  # seconds a probed format list is reused
+FORMAT_CACHE_MAX = 200  # URLs kept in the cache file
+# the part of yt-dlp's format list the preset matcher and the size estimate need
+FORMAT_FIELDS = ('format_id', 'ext', 'vcodec', 'acodec', 'height', 'width', 'fps', 'tbr', 'abr',
+                 'filesize', 'filesize_approx')
+FORMAT_SPEC_RE = re.compile(r'^(\w+\*?)((?:\[[^\]]*\])*)$')
+FORMAT_FILTER_RE = re.compile(r'\[(\w+)\s*(<=|>=|!=|\*=|\^=|\$=|=|<|>)\s*([^\]]+)\]')
+# yt-dlp's own --cache-dir (YouTube player/signature code, ...), shared by every job
+YTDLP_CACHE_DIR = CONFIG_DIR / 'ytdlp_cache'
+YTDLP_CACHE_MAX_BYTES = 256 * 1024 * 1024  # least recently used files go above this
+YTDLP_CACHE_WARM_FILE = CONFIG_DIR / 'ytdlp_cache_warm.json'  # site -> time of the last warm-up
+YTDLP_CACHE_WARM_TTL = 6 * 3600  # seconds before a site is warmed up again
+YTDLP_CACHE_WARM_SITES = 4  # sites warmed up at one queue start
+YTDLP_CACHE_WARM_TIMEOUT = 90  # seconds; the site's items wait at most this long
+BATCH_DIR = CONFIG_DIR / 'batches'  # -a files of running batches
+ARCHIVE_DIR = CONFIG_DIR / 'archives'  # --download-archive files, one per (dir, format)
+ARCHIVE_DIR.mkdir(exist_ok=True)
+
+# URLs in pasted text or a CSV/text export: anything from a scheme or a bare youtube host to a separator
+URL_TOKEN_RE = re.compile(r'(?:https?://|(?<![\w.])(?:www\.|m\.)?(?:youtube\.com|youtu\.be)/)[^\s,;"\'<>]+', re.IGNORECASE)
+YOUTUBE_KEEP_PARAMS = ('list',)  # besides v; the rest (si, pp, feature, t, ...) only defeats dedupe
+# IDs we can read without asking yt-dlp: YouTube URLs and our own file names
+YOUTUBE_ID_RE = re.compile(r'(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/)|youtu\.be/)([A-Za-z0-9_-]{11})')
+FILE_ID_RE = re.compile(r'\[([A-Za-z0-9_-]+)\]\.([A-Za-z0-9]+)$')
+AUDIO_EXTS = {'m4a', 'mp3', 'opus', 'ogg', 'webm', 'wav', 'flac', 'aac'}
+AUDIO_CODEC_EXTS = {'aac': 'm4a', 'alac': 'm4a', 'vorbis': 'ogg'}  # --audio-format -> file ext, where they differ
+QUEUE_KEEP_FINISHED = 1000  # done/failed rows kept in the journal as history
+METRICS_FILE = CONFIG_DIR / 'metrics.jsonl'  # one record per finished item
+METRICS_FILE_MAX_BYTES = 10 * 1024 * 1024  # rolled over to <name>.1
+# Prometheus textfile-collector output; point it into node_exporter's textfile dir
+METRICS_PROM_FILE = Path(os.environ.get('YTDLP_METRICS_PROM') or CONFIG_DIR / 'metrics.prom')
+EXTRACTOR_LINE_RE = re.compile(r'^\[(?!debug\]|download\]|info\]|Merger\]|ExtractAudio\]|ffmpeg\])([\w:.-]+)\] ')
+# signs of a struggling connection in yt-dlp output (auto -N backs off on them)
+NET_ERROR_RE = re.compile(r'HTTP Error (?:403|429|5\d\d)|Got error|Retrying fragment|fragment not found|timed out', re.IGNORECASE)
+NET_TUNING_FILE = CONFIG_DIR / 'net_threads.json'  # auto -N: what worked per extractor/host
+AUTO_N_LEVELS = (1, 2, 4, 8, 16, 32)
+AUTO_N_START = 4  # conservative: some hosts throttle above 4 fragments
+AUTO_N_SAMPLES = 2  # clean items at a level before the next one up is tried
+AUTO_N_MAX_ERROR = 0.3  # error-rate EWMA at which a level is abandoned
+AUTO_N_ALPHA = 0.3  # EWMA weight of the newest sample
+# the site is pushing back: pause its lane instead of failing the item
+RATE_LIMITED_RE = re.compile(r'HTTP Error (?:403|429)', re.IGNORECASE)  # subset of NET_ERROR_RE
+DEFAULT_HOST_PARALLEL = 2  # items from one site in flight
+HOST_BACKOFF_BASE = 30.0  # seconds; doubles with every rate-limited item in a row
+HOST_BACKOFF_MAX = 30 * 60.0
+HOST_BACKOFF_RETRIES = 5  # rate-limited attempts per item before it counts as failed
+# failures a retry won't fix; anything else is retried with backoff
+PERMANENT_ERROR_RE = re.compile(
+    r'Video unavailable|Private video|This video (?:is|has been) (?:private|removed|unavailable)|members[- ]only'
+    r'|Unsupported URL|is not a valid URL|copyright|has been terminated|not available in your country'
+    r'|Sign in to confirm your age|HTTP Error (?:404|410)|Requested format is not available'
+    r'|Postprocessing:|ffmpeg (?:is )?not found', re.IGNORECASE)
+DEFAULT_RETRIES = 3  # automatic retries of a failed item
+RETRY_BASE = 10.0  # seconds; doubles with every retry of the item
+RETRY_MAX_DELAY = 10 * 60.0
+# shortest-job-first: pending items ordered by their expected size
+SJF_BYTES_PER_SECOND = 512 * 1024  # only the duration is known: ~4 Mbit/s, a 1080p stream
+SJF_UNKNOWN_SIZE = 300 * 1024 * 1024  # nothing known: ranks like a ~10 min video
+# post-processing pool: transcodes/embedding run here, off the download slots
+POSTPROCESS_PARALLEL = os.cpu_count() or 2
+# yt-dlp options that only post-process the downloaded file: option -> takes a value
+POSTPROCESS_OPTIONS = {'--extract-audio': False, '--audio-format': True, '--audio-quality': True,
+                       '--embed-thumbnail': False, '--embed-subs': False}
+# options the post-processing run needs to find the same file again
+POSTPROCESS_KEEP = {'-f': True, '-o': True, '-k': False, '--windows-filenames': False, '--ffmpeg-location': True}
+# only the post-processing run records the ID: a download alone doesn't make the item done
+POSTPROCESS_MOVE = {'--download-archive': True}
+# external downloader for plain HTTP(S)/FTP streams; DASH/HLS fragments stay on -N
+ARIA2_PROTOCOLS = 'http,https,ftp,ftps'
+DEFAULT_ARIA2_CONNECTIONS = 16  # aria2c -x, connections per server (aria2c caps it at 16)
+DEFAULT_ARIA2_SPLIT = 16  # aria2c -s, pieces downloaded in parallel
+# aria2c console readout: "[#2089b0 1.0MiB/33MiB(3%) CN:16 DL:2.1MiB ETA:15s]"
+ARIA2_PROGRESS_RE = re.compile(
+    r'^\[#\w+ ([\d.]+)(\w*?)(?:/([\d.]+)(\w*?)\(\d+%\))? CN:\d+ DL:([\d.]+)(\w*?)(?: ETA:(\w+))?\]')
+ARIA2_UNITS = ('B', 'KiB', 'MiB', 'GiB', 'TiB')
+# several items with the same argv but the URL share one yt-dlp process (-a batch file)
+DEFAULT_BATCH_ITEMS = 10  # items per process, 1 = no batching
+MAX_BATCH_ITEMS = 50
+EXTRACTING_URL_RE = re.compile(r'^\[[\w:.-]+\] Extracting URL: (.+?)\s*$')  # yt-dlp moved on to this URL
+ERROR_ID_RE = re.compile(r'^ERROR: \[[\w:.-]+\] ([\w-]+):')
+INFO_JSON_RE = re.compile(r'^\[info\] Writing video metadata as JSON to: (.+?)\s*$')
+HOST_ALIASES = {'youtu.be': 'youtube.com', 'm.youtube.com': 'youtube.com', 'music.youtube.com': 'youtube.com'}
+POSTPROCESS_TAGS = ('[Merger]', '[ExtractAudio]', '[ffmpeg]')
+RATE_RE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)(?:i?B)?(?:/s)?\s*$', re.IGNORECASE)
+
+
+@dataclass
+class ProgressEvent:
+    """One progress report emitted through PROGRESS_TEMPLATE."""
+    video_id: str
+    status: str = 'downloading'
+    downloaded_bytes: int = 0
+    total_bytes: int | None = None  # exact or estimated
+    speed: float | None = None  # bytes/s
+    eta: int | None = None  # seconds
+    elapsed: float | None = None
+    fragment_index: int | None = None
+    fragment_count: int | None = None
+
+    @property
+    def percent(self) -> float | None:
+        if self.status == 'finished':
+            return 100.0
+        if not self.total_bytes:
+            return None
+        return max(0.0, min(100.0, 100.0 * self.downloaded_bytes / self.total_bytes))
+
+
+def progress_event(video_id: str, data: dict) -> ProgressEvent:
+    """ProgressEvent from a PROGRESS_FIELDS dict (template JSON or a progress hook)."""
+    return ProgressEvent(
+        video_id=video_id,
+        status=data.get('status') or 'downloading',
+        downloaded_bytes=int(data.get('downloaded_bytes') or 0),
+        total_bytes=data.get('total_bytes') or data.get('total_bytes_estimate'),
+        speed=data.get('speed'),
+        eta=data.get('eta'),
+        elapsed=data.get('elapsed'),
+        fragment_index=data.get('fragment_index'),
+        fragment_count=data.get('fragment_count'),
+    )
+
+
+def _aria2_bytes(number: str, unit: str) -> int:
+    return int(float(number) * 1024 ** ARIA2_UNITS.index(unit or 'B'))
+
+
+def parse_aria2_line(line: str, video_id: str) -> ProgressEvent | None:
+    """ProgressEvent from an aria2c readout line; None for anything else."""
+    m = ARIA2_PROGRESS_RE.match(line)
+    if not m:
+        return None
+    done, done_unit, total, total_unit, speed, speed_unit, eta = m.groups()
+    try:
+        return ProgressEvent(
+            video_id=video_id,
+            downloaded_bytes=_aria2_bytes(done, done_unit),
+            total_bytes=_aria2_bytes(total, total_unit) if total else None,
+            speed=float(_aria2_bytes(speed, speed_unit)),
+            eta=sum(int(n) * {'h': 3600, 'm': 60, 's': 1}[u] for n, u in re.findall(r'(\d+)([hms])', eta or '')) or None,
+        )
+    except ValueError:
+        return None
+
+
+def parse_progress_line(line: str) -> ProgressEvent | None:
+    """Parse a PROGRESS_TEMPLATE line; None for anything else or garbage."""
+    if not line.startswith(PROGRESS_PREFIX):
+        return None
+    try:
+        video_id, payload = line[len(PROGRESS_PREFIX):].split(' ', 1)
+        return progress_event(video_id, json.loads(payload))
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+
+@dataclass
+class QueueItem:
+    """A download waiting in the queue (one row of the queue journal)."""
+    url: str
+    command: list[str]
+    final_dir: str
+    item_id: int | None = None  # QueueStore row id
+    video_id: str | None = None  # known before download for YouTube/playlist entries
+    priority: int = 0  # higher goes first
+    position: float | None = None  # order within a priority; PendingQueue assigns it
+    duration: float | None = None  # seconds, from playlist/format metadata
+    filesize: int | None = None  # bytes, estimated for the chosen format
+
+    @property
+    def fmt(self) -> str:
+        try:
+            return self.command[self.command.index('-f') + 1]
+        except (ValueError, IndexError):
+            return ''
+
+    @property
+    def output_key(self) -> str:
+        """What ends up on disk: the format, plus the audio codec it is converted to."""
+        try:
+            return f"{self.fmt} -x {self.command[self.command.index('--audio-format') + 1]}"
+        except (ValueError, IndexError):
+            return self.fmt
+
+    @property
+    def expected_size(self) -> int:
+        """Shortest-job-first key: the size estimate, else the duration at a typical bitrate."""
+        if self.filesize:
+            return self.filesize
+        if self.duration:
+            return int(self.duration * SJF_BYTES_PER_SECOND)
+        return SJF_UNKNOWN_SIZE
+
+
+@dataclass
+class DownloadOptions:
+    """Everything that goes into a yt-dlp command apart from URL and paths."""
+    fmt: str
+    net_threads: int = 8  # -N
+    limit_rate: str = ''  # e.g. 5M
+    keep_temp: bool = False  # -k
+    embed_thumbnail: bool = False
+    embed_subs: bool = False
+    playlist_all: bool = False  # expand playlists into single-video items
+    audio_format: str = ''  # --extract-audio --audio-format (AUDIO_CONVERT)
+    audio_quality: str = ''
+    aria2: bool = False  # ARIA2_PROTOCOLS through aria2c instead of yt-dlp's own downloader
+    aria2_connections: int = DEFAULT_ARIA2_CONNECTIONS  # -x
+    aria2_split: int = DEFAULT_ARIA2_SPLIT  # -s
+
+    @property
+    def output_key(self) -> str:
+        return f"{self.fmt} -x {self.audio_format}" if self.audio_format else self.fmt
+
+    @classmethod
+    def from_preset(cls, name: str, **kwargs) -> 'DownloadOptions':
+        """Options for a FORMAT_OPTIONS preset name or a raw -f expression."""
+        fmt = find_format(name)
+        audio = AUDIO_CONVERT.get(name.split(' - ', 1)[-1], ('', '')) if fmt != name else ('', '')
+        return cls(fmt, audio_format=audio[0], audio_quality=audio[1], **kwargs)
+
+    @classmethod
+    def from_settings(cls, settings: 'SettingsStore', fmt: str | None = None) -> 'DownloadOptions':
+        """Options as last saved by the GUI; `fmt` (preset or -f expression) overrides the saved format."""
+        opts = settings.get('opts')
+        opts = opts if isinstance(opts, dict) else {}
+        return cls.from_preset(
+            fmt or settings.get('last_format') or 'Видео (WebM) - 1080p',
+            net_threads=int(opts.get('net_threads') or 8),
+            limit_rate=str(opts.get('limit_rate') or ''),
+            keep_temp=bool(opts.get('keep_temp')),
+            embed_thumbnail=bool(opts.get('embed_thumbnail')),
+            embed_subs=bool(opts.get('embed_subs')),
+            playlist_all=bool(opts.get('playlist_all')),
+            aria2=bool(opts.get('aria2')),
+            aria2_connections=int(opts.get('aria2_connections') or DEFAULT_ARIA2_CONNECTIONS),
+            aria2_split=int(opts.get('aria2_split') or DEFAULT_ARIA2_SPLIT),
+        )
+
+
+def build_command(options: DownloadOptions, final_dir: str, archive: Path | None = None) -> list[str]:
+    """yt-dlp argv for `options`, without the URL."""
+    # --continue: a resumed item picks up its .part files
+    cmd = [YTDLP_BIN, '-v', '--newline', '--progress-template', PROGRESS_TEMPLATE,
+           '--continue', '-N', str(options.net_threads), '-f', options.fmt]
+
+    # apply options
+    if options.keep_temp:
+        cmd.append('-k')
+    if options.embed_thumbnail:
+        cmd.extend(['--embed-thumbnail'])
+    if options.embed_subs:
+        cmd.extend(['--embed-subs'])
+    if options.audio_format:
+        cmd.extend(['--extract-audio', '--audio-format', options.audio_format])
+        if options.audio_quality:
+            cmd.extend(['--audio-quality', options.audio_quality])
+    # playlists are expanded into single-video items before they get here
+    cmd.append('--no-playlist')
+    if options.limit_rate.strip():
+        cmd.extend(['--limit-rate', options.limit_rate.strip()])
+    if options.aria2:
+        # yt-dlp falls back to its own downloader if aria2c isn't installed
+        cmd.extend(['--downloader', f'{ARIA2_PROTOCOLS}:aria2c', '--downloader-args',
+                    f'aria2c:-x{options.aria2_connections} -s{options.aria2_split} -k1M'])
+
+    # platform-specific filename policy
+    if sys.platform.startswith('win'):
+        cmd.append('--windows-filenames')
+
+    # one cache for every job: extractor state (player code, ...) is worked out once
+    cmd.extend(['--cache-dir', str(YTDLP_CACHE_DIR)])
+
+    # output template; the archive lets yt-dlp record and skip finished IDs
+    out_tmpl = os.path.join(final_dir, '%(title).180B [%(id)s].%(ext)s')
+    cmd.extend(['-o', out_tmpl])
+    if archive is not None:
+        cmd.extend(['--download-archive', str(archive)])
+    return cmd
+
+
+class QueueStore:
+    """Crash-safe queue journal: a SQLite file in CONFIG_DIR.
+
+    Every item is written when it is enqueued and its state is updated as it
+    moves through pending -> running -> done/failed, so a crash or a closed
+    window loses nothing. Items left in 'running' were interrupted and are
+    resumed on the next start.
+    """
+
+    def __init__(self, path: Path = QUEUE_DB):
+        self.conn = sqlite3.connect(str(path))
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS items ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' url TEXT NOT NULL,'
+            ' command TEXT NOT NULL,'
+            ' final_dir TEXT NOT NULL,'
+            " state TEXT NOT NULL DEFAULT 'pending',"
+            ' return_code INTEGER,'
+            ' updated REAL NOT NULL,'
+            ' video_id TEXT)')
+        self._migrate()
+        self.conn.commit()
+
+    def _migrate(self):
+        # journals written by older versions lack the newer columns
+        cols = {row[1] for row in self.conn.execute('PRAGMA table_info(items)')}
+        if 'video_id' not in cols:
+            self.conn.execute('ALTER TABLE items ADD COLUMN video_id TEXT')
+        for name, decl in (('priority', 'INTEGER NOT NULL DEFAULT 0'), ('position', 'REAL'),
+                           ('duration', 'REAL'), ('filesize', 'INTEGER')):
+            if name not in cols:
+                self.conn.execute(f'ALTER TABLE items ADD COLUMN {name} {decl}')
+
+    def add(self, item: QueueItem) -> QueueItem:
+        return self.add_many([item])[0]
+
+    def add_many(self, items: list[QueueItem]) -> list[QueueItem]:
+        """Journal several items in one transaction."""
+        now = time.time()
+        with self.conn:
+            for item in items:
+                cur = self.conn.execute(
+                    'INSERT INTO items (url, command, final_dir, updated, video_id, priority, position,'
+                    ' duration, filesize) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (item.url, json.dumps(item.command), item.final_dir, now, item.video_id,
+                     item.priority, item.position, item.duration, item.filesize))
+                item.item_id = cur.lastrowid
+        return items
+
+    def set_order(self, items: list[QueueItem]):
+        """Journal a manual reorder or priority change."""
+        with self.conn:
+            self.conn.executemany('UPDATE items SET priority = ?, position = ? WHERE id = ?',
+                                  [(i.priority, i.position, i.item_id) for i in items if i.item_id is not None])
+
+    def set_state(self, item: QueueItem, state: str, return_code: int | None = None):
+        if item.item_id is None:
+            return
+        with self.conn:
+            self.conn.execute('UPDATE items SET state = ?, return_code = ?, updated = ? WHERE id = ?',
+                              (state, return_code, time.time(), item.item_id))
+
+    def clear_pending(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM items WHERE state = 'pending'")
+
+    def recover(self) -> tuple[list[QueueItem], int]:
+        """Return unfinished items in queue order and how many were interrupted."""
+        with self.conn:
+            interrupted = self.conn.execute(
+                "UPDATE items SET state = 'pending' WHERE state = 'running'").rowcount
+            # trim history so the journal doesn't grow forever
+            self.conn.execute(
+                "DELETE FROM items WHERE state IN ('done', 'failed') AND id NOT IN ("
+                " SELECT id FROM items WHERE state IN ('done', 'failed') ORDER BY id DESC LIMIT ?)",
+                (QUEUE_KEEP_FINISHED,))
+        rows = self.conn.execute(
+            "SELECT id, url, command, final_dir, video_id, priority, position, duration, filesize"
+            " FROM items WHERE state = 'pending' ORDER BY id").fetchall()
+        return [QueueItem(url, json.loads(cmd), final_dir, item_id, video_id, priority, position, duration, filesize)
+                for item_id, url, cmd, final_dir, video_id, priority, position, duration, filesize in rows], interrupted
+
+    def close(self):
+        try:
+            self.conn.close()
+        except sqlite3.Error:
+            pass
+
+
+class PlaylistResolver:
+    """Expand a playlist URL into its videos with a flat extraction.
+
+    Results are cached in PLAYLIST_CACHE_FILE for PLAYLIST_CACHE_TTL, so adding
+    the same playlist again doesn't start yt-dlp at all. Safe to call from
+    several threads.
+    """
+
+    def __init__(self, path: Path = PLAYLIST_CACHE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._cache: dict | None = None  # loaded on first use
+
+    def _load(self) -> dict:
+        if self._cache is None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                data = {}
+            self._cache = data if isinstance(data, dict) else {}
+        return self._cache
+
+    def cached(self, url: str) -> list[dict] | None:
+        with self._lock:
+            entry = self._load().get(url)
+        if isinstance(entry, dict) and time.time() - entry.get('ts', 0) < PLAYLIST_CACHE_TTL:
+            return entry.get('entries')
+        return None
+
+    def resolve(self, url: str) -> list[dict]:
+        """Return [{'id', 'url', 'title', 'duration'}]; empty if `url` is a single video.
+
+        Raises RuntimeError if yt-dlp can't extract the URL.
+        """
+        entries = self.cached(url)
+        if entries is not None:
+            return entries
+        try:
+            proc = subprocess.run([YTDLP_BIN, '--flat-playlist', '--yes-playlist', '-J', '--no-warnings', url],
+                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                  encoding='utf-8', errors='replace', timeout=600)
+        except (OSError, subprocess.SubprocessError) as e:
+            raise RuntimeError(str(e)) from e
+        if proc.returncode != 0:
+            err = (proc.stderr.strip().splitlines() or [f"код {proc.returncode}"])[-1]
+            raise RuntimeError(err)
+        try:
+            info = json.loads(proc.stdout)
+        except ValueError as e:
+            raise RuntimeError(f"неверный ответ yt-dlp: {e}") from e
+        entries = []
+        for e in info.get('entries') or []:
+            entry_url = isinstance(e, dict) and (e.get('url') or e.get('webpage_url'))
+            if entry_url:
+                entries.append({'id': e.get('id'), 'url': entry_url,
+                                'title': e.get('title'), 'duration': e.get('duration')})
+        with self._lock:
+            cache = self._load()
+            cache[url] = {'ts': time.time(), 'entries': entries}
+            if len(cache) > PLAYLIST_CACHE_MAX:
+                for old in sorted(cache, key=lambda k: cache[k].get('ts', 0))[:len(cache) - PLAYLIST_CACHE_MAX]:
+                    del cache[old]
+            try:
+                write_json_atomic(self.path, cache)
+            except OSError:
+                pass
+        return entries
+
+
+class FormatProber:
+    """Fetch a video's format list once, before anything is queued.
+
+    Results are cached in FORMAT_CACHE_FILE for FORMAT_CACHE_TTL, so switching
+    presets or re-entering the URL costs nothing. Safe to call from several
+    threads.
+    """
+
+    def __init__(self, path: Path = FORMAT_CACHE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._cache: dict | None = None  # loaded on first use
+
+    def _load(self) -> dict:
+        if self._cache is None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                data = {}
+            self._cache = data if isinstance(data, dict) else {}
+        return self._cache
+
+    def cached(self, url: str) -> dict | None:
+        with self._lock:
+            entry = self._load().get(url)
+        if isinstance(entry, dict) and time.time() - entry.get('ts', 0) < FORMAT_CACHE_TTL:
+            return entry.get('info')
+        return None
+
+    def probe(self, url: str) -> dict:
+        """Return {'title', 'duration', 'formats': [FORMAT_FIELDS dicts]}; no formats for playlists.
+
+        Raises RuntimeError if yt-dlp can't extract the URL.
+        """
+        info = self.cached(url)
+        if info is not None:
+            return info
+        try:
+            proc = subprocess.run([YTDLP_BIN, '-J', '--no-playlist', '--no-warnings',
+                                   '--cache-dir', str(YTDLP_CACHE_DIR), url],
+                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                  encoding='utf-8', errors='replace', timeout=120)
+        except (OSError, subprocess.SubprocessError) as e:
+            raise RuntimeError(str(e)) from e
+        if proc.returncode != 0:
+            err = (proc.stderr.strip().splitlines() or [f"код {proc.returncode}"])[-1]
+            raise RuntimeError(err)
+        try:
+            data = json.loads(proc.stdout)
+        except ValueError as e:
+            raise RuntimeError(f"неверный ответ yt-dlp: {e}") from e
+        formats = data.get('formats') or ([data] if data.get('url') else [])
+        info = {'title': data.get('title'), 'duration': data.get('duration'),
+                'formats': [{k: f.get(k) for k in FORMAT_FIELDS} for f in formats if isinstance(f, dict)]}
+        with self._lock:
+            cache = self._load()
+            cache[url] = {'ts': time.time(), 'info': info}
+            if len(cache) > FORMAT_CACHE_MAX:
+                for old in sorted(cache, key=lambda k: cache[k].get('ts', 0))[:len(cache) - FORMAT_CACHE_MAX]:
+                    del cache[old]
+            try:
+                write_json_atomic(self.path, cache)
+            except OSError:
+                pass
+        return info
+
+
+class YtdlpCache:
+    """The --cache-dir every job shares, with warm-up, stats and a size cap.
+
+    yt-dlp caches extractor state there (YouTube player and signature code,
+    ...). warm() runs one extraction for a site before its items go out in
+    parallel, so N workers don't all work the same state out at once;
+    evict() keeps the directory under max_bytes, least recently used first.
+    """
+
+    def __init__(self, path: Path = YTDLP_CACHE_DIR, max_bytes: int = YTDLP_CACHE_MAX_BYTES,
+                 warm_file: Path = YTDLP_CACHE_WARM_FILE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.warm_file = warm_file
+        self._lock = threading.Lock()
+        try:
+            with open(warm_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        self._warmed: dict[str, float] = data if isinstance(data, dict) else {}
+
+    def needs_warmup(self, site: str) -> bool:
+        with self._lock:
+            return time.time() - self._warmed.get(site, 0) > YTDLP_CACHE_WARM_TTL
+
+    def warm(self, site: str, url: str) -> float:
+        """Extract `url` without downloading to fill the cache; returns the seconds it took.
+        A failed warm-up is not an error: the first real job fills the cache instead."""
+        t0 = time.monotonic()
+        try:
+            subprocess.run([YTDLP_BIN, '--skip-download', '--no-playlist', '--quiet', '--no-warnings',
+                            '--cache-dir', str(self.path), url],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                           timeout=YTDLP_CACHE_WARM_TIMEOUT)
+        except (OSError, subprocess.SubprocessError):
+            pass
+        with self._lock:
+            self._warmed[site] = time.time()
+            try:
+                write_json_atomic(self.warm_file, self._warmed)
+            except OSError:
+                pass
+        return time.monotonic() - t0
+
+    def _files(self) -> list[tuple[float, int, str]]:
+        """(last use, size, path) of every cached file."""
+        files = []
+        for dirpath, _dirs, names in os.walk(self.path):
+            for name in names:
+                full = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(full)
+                except OSError:
+                    continue
+                files.append((max(st.st_atime, st.st_mtime), st.st_size, full))
+        return files
+
+    def stats(self) -> dict:
+        """{'files', 'bytes', 'sections': {section: bytes}}; a section is yt-dlp's
+        subdirectory per kind of data, e.g. youtube-nsig."""
+        sections: dict[str, int] = {}
+        files = self._files()
+        for _used, size, full in files:
+            section = os.path.relpath(full, self.path).split(os.sep)[0]
+            sections[section] = sections.get(section, 0) + size
+        return {'files': len(files), 'bytes': sum(sections.values()), 'sections': sections}
+
+    def evict(self) -> int:
+        """Drop least recently used files until the cache fits max_bytes; returns bytes freed."""
+        files = self._files()
+        excess = sum(size for _used, size, _full in files) - self.max_bytes
+        freed = 0
+        for _used, size, full in sorted(files):
+            if freed >= excess:
+                break
+            try:
+                os.remove(full)
+                freed += size
+            except OSError:
+                pass
+        return freed
+
+
+class UrlValidator:
+    """Check URLs against yt-dlp's extractor patterns (not the generic one).
+
+    Extractors are loaded on first use and remembered per host, so a channel
+    export of 2000 links costs one full scan. Without the yt_dlp package
+    every URL passes.
+    """
+
+    def __init__(self):
+        self._extractors: list | None = None
+        self._by_host: dict[str, list] = {}  # host -> extractors that matched there
+        self._lock = threading.Lock()
+
+    def _load(self) -> list:
+        if self._extractors is None:
+            try:
+                from yt_dlp.extractor import gen_extractor_classes
+                self._extractors = [ie for ie in gen_extractor_classes() if ie.ie_key() != 'Generic']
+            except ImportError:
+                self._extractors = []
+        return self._extractors
+
+    def unknown(self, urls: list[str]) -> list[str]:
+        """URLs no specific extractor claims (worker thread)."""
+        with self._lock:
+            extractors = self._load()
+            if not extractors:
+                return []
+            missed = []
+            for url in urls:
+                host = url_host(url)
+                known = self._by_host.get(host)
+                if known and any(ie.suitable(url) for ie in known):
+                    continue
+                if known == []:
+                    missed.append(url)  # no extractor for this site; skip the full scan
+                    continue
+                ie = next((ie for ie in extractors if ie.suitable(url)), None)
+                if ie is None:
+                    self._by_host.setdefault(host, [])
+                    missed.append(url)
+                else:
+                    self._by_host.setdefault(host, []).append(ie)
+            return missed
+
+
+class DownloadIndex:
+    """IDs already downloaded, per (output dir, format).
+
+    Each pair has its own yt-dlp --download-archive file in ARCHIVE_DIR, which
+    yt-dlp keeps up to date. The first time a pair is used, the output dir is
+    also scanned once for '... [<id>].<ext>' files; those IDs are saved next
+    to the archive, so the scan is never repeated.
+    """
+
+    def __init__(self, root: Path = ARCHIVE_DIR):
+        self.root = root
+        self._ids: dict[str, set[str]] = {}
+
+    @staticmethod
+    def _key(final_dir: str, fmt: str) -> str:
+        raw = f"{os.path.normcase(os.path.abspath(final_dir))}\n{fmt}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+    def archive_path(self, final_dir: str, fmt: str) -> Path:
+        return self.root / f"{self._key(final_dir, fmt)}.txt"
+
+    def _load(self, final_dir: str, fmt: str) -> set[str]:
+        key = self._key(final_dir, fmt)
+        ids = self._ids.get(key)
+        if ids is not None:
+            return ids
+        ids = set()
+        try:
+            with open(self.root / f"{key}.txt", 'r', encoding='utf-8') as f:
+                for line in f:
+                    parts = line.split()  # "<extractor> <id>"
+                    if len(parts) == 2:
+                        ids.add(parts[1])
+        except OSError:
+            pass
+        scan_path = self.root / f"{key}.scan"
+        try:
+            with open(scan_path, 'r', encoding='utf-8') as f:
+                ids.update(line.strip() for line in f if line.strip())
+        except OSError:
+            found = scan_output_dir(final_dir, expected_exts(fmt))
+            ids |= found
+            try:
+                with open(scan_path, 'w', encoding='utf-8') as f:
+                    f.writelines(f"{vid}\n" for vid in sorted(found))
+            except OSError:
+                pass
+        self._ids[key] = ids
+        return ids
+
+    def contains(self, final_dir: str, fmt: str, video_id: str) -> bool:
+        return video_id in self._load(final_dir, fmt)
+
+    def add(self, final_dir: str, fmt: str, video_id: str):
+        # the archive file itself is written by yt-dlp
+        self._load(final_dir, fmt).add(video_id)
+
+
+class SettingsStore:
+    """config.json held in memory: parsed once, written only when changed.
+
+    Unknown keys are preserved. save() goes through a temp file + rename, so a
+    crash mid-write can't leave a truncated config behind.
+    """
+
+    def __init__(self, path: Path = CONFIG_FILE):
+        self.path = path
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        self.data: dict = data if isinstance(data, dict) else {}
+        self.dirty = False
+
+    def get(self, key: str, default=None):
+        return self.data.get(key, default)
+
+    def update(self, values: dict):
+        for key, value in values.items():
+            if self.data.get(key) != value:
+                self.data[key] = value
+                self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        write_json_atomic(self.path, self.data)
+        self.dirty = False
+
+
+@dataclass
+class JobTimes:
+    """Wall-clock timestamps of one item's phases (time.time(), None = not reached)."""
+    dispatched: float | None = None  # handed to a worker
+    spawned: float | None = None  # process started / task sent to the worker
+    first_output: float | None = None
+    extract_start: float | None = None  # first "[<extractor>] ..." line
+    download_start: float | None = None
+    download_end: float | None = None  # last finished stream
+    postprocess_start: float | None = None  # first [Merger]/[ExtractAudio]/[ffmpeg] line
+    exited: float | None = None
+    slot_freed: float | None = None  # exit of the item whose slot this one took
+
+    def mark(self, name: str):
+        if getattr(self, name) is None:
+            setattr(self, name, time.time())
+
+    def phases(self) -> dict[str, float | None]:
+        """Seconds per phase; the spawn phase is the gap before yt-dlp says anything."""
+        def span(a, b):
+            return round(b - a, 3) if a is not None and b is not None else None
+        return {
+            'wait': span(self.slot_freed, self.dispatched),
+            'spawn': span(self.dispatched, self.first_output),
+            'extract': span(self.extract_start or self.first_output, self.download_start),
+            'download': span(self.download_start, self.download_end),
+            'postprocess': span(self.postprocess_start, self.exited),
+            'total': span(self.dispatched, self.exited),
+        }
+
+
+@dataclass
+class DownloadJob:
+    """A queue item that has been handed to a worker."""
+    job_id: int
+    item: QueueItem
+    process: subprocess.Popen | None = None
+    worker: 'InProcessWorker | None' = None  # set instead of `process` on the in-process backend
+    stopped: bool = False
+    percent: float = 0.0  # written by the reader thread, read by the host
+    log_path: Path | None = None
+    return_code: int | None = None
+    last_event: ProgressEvent | None = None
+    bytes_finished: int = 0  # sum over files already completed (video + audio, ...)
+    backend: str = BACKEND_SUBPROCESS
+    rate_limit: int | None = None  # share of QueueEngine.total_rate, bytes/s
+    net_threads: int | None = None  # -N chosen by NetThreadsTuner ("авто")
+    extractor: str | None = None  # from the first "[<extractor>] ..." line
+    net_errors: int = 0  # NET_ERROR_RE lines seen
+    rate_limited: bool = False  # RATE_LIMITED_RE seen: the host wants us to slow down
+    error: str = ''  # last "ERROR:" line
+    split_post: bool = False  # download only; POSTPROCESS_OPTIONS run later in the post pool
+    info_json: str | None = None  # written by the download run for the post-processing run
+    stage: str = 'download'  # 'download' -> 'post'
+    batch: 'BatchRun | None' = None  # shares its yt-dlp process with other items
+    times: JobTimes = field(default_factory=JobTimes)
+
+    def apply_progress(self, ev: ProgressEvent):
+        self.times.mark('download_start')
+        if ev.status == 'finished':
+            self.bytes_finished += ev.total_bytes or ev.downloaded_bytes
+            self.times.download_end = time.time()
+        if ev.percent is not None:
+            self.percent = ev.percent
+        self.last_event = ev
+
+    @property
+    def url(self) -> str:
+        return self.item.url
+
+    @property
+    def command(self) -> list[str]:
+        """The item's argv with this job's rate share and auto -N applied."""
+        cmd = split_postprocess(self.item.command)[0] if self.split_post else self.item.command
+        return with_net_threads(with_rate_limit(cmd, self.rate_limit), self.net_threads)
+
+    @property
+    def final_dir(self) -> str:
+        return self.item.final_dir
+
+    @property
+    def downloaded_bytes(self) -> int:
+        ev = self.last_event
+        if ev is None or ev.status == 'finished':
+            return self.bytes_finished
+        return self.bytes_finished + ev.downloaded_bytes
+
+    @property
+    def speed(self) -> float:
+        ev = self.last_event
+        return (ev.speed or 0.0) if ev and ev.status == 'downloading' else 0.0
+
+
+@dataclass
+class BatchRun:
+    """Compatible items downloaded by one yt-dlp process from a batch file (-a).
+
+    The reader thread attributes every output line to a member: progress and
+    ERROR lines by video ID, the rest to the item yt-dlp is working on, which
+    changes at each "Extracting URL" line. A member is finished as soon as
+    yt-dlp moves past it.
+    """
+    jobs: list[DownloadJob]
+    path: Path
+    killed: bool = False  # a member was stopped, which took the whole process down
+
+
+class ItemLog:
+    """Full output of one queue item, streamed to its own file in LOGS_DIR.
+
+    Only the reader thread of that item writes here. When the file grows past
+    LOG_FILE_MAX_BYTES it is moved to `<name>.1` and a fresh file is started.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._f = open(path, 'a', encoding='utf-8')
+        self._size = self._f.tell()
+
+    def write(self, text: str):
+        if self._size + len(text) > LOG_FILE_MAX_BYTES:
+            self._rotate()
+        self._f.write(text)
+        self._size += len(text)
+
+    def _rotate(self):
+        self._f.close()
+        os.replace(self.path, self.path.with_name(self.path.name + '.1'))
+        self._f = open(self.path, 'w', encoding='utf-8')
+        self._size = 0
+
+    def close(self):
+        try:
+            self._f.close()
+        except Exception:
+            pass
+
+
+def prune_item_logs(keep: int = LOG_KEEP_FILES):
+    """Delete the oldest item logs so that at most `keep` remain."""
+    try:
+        logs = sorted(LOGS_DIR.glob('*.log'), key=lambda p: p.stat().st_mtime)
+    except OSError:
+        return
+    for old in logs[:-keep] if keep else logs:
+        for p in (old, old.with_name(old.name + '.1')):
+            try:
+                p.unlink()
+            except OSError:
+                pass
+
+
+class OutputBuffer:
+    """Thread-safe hand-off from worker threads to the host thread.
+
+    Reader threads only append; the host drains everything on a fixed tick,
+    so it sees one batch per tick instead of one callback per line.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lines: list[tuple[str, str]] = []
+        self._calls: list[tuple[Callable, tuple]] = []
+
+    def put(self, text: str, tag: str = ''):
+        with self._lock:
+            self._lines.append((text, tag))
+
+    def post(self, fn: Callable, *args):
+        """Run `fn(*args)` on the host thread at the next drain."""
+        with self._lock:
+            self._calls.append((fn, args))
+
+    def drain(self) -> tuple[list[tuple[str, str]], list[tuple[Callable, tuple]]]:
+        # a job's lines are always put before its finish is posted, so a
+        # drained finish never overtakes output that is still buffered
+        with self._lock:
+            lines, self._lines = self._lines, []
+            calls, self._calls = self._calls, []
+        return lines, calls
+
+
+def classify_line(job: DownloadJob, line: str) -> tuple[str, str] | None:
+    """Tag one output line for the log (reader thread).
+
+    Progress events only update the job; they are not logged. Phase
+    timestamps are taken here as the lines go by.
+    """
+    times = job.times
+    times.mark('first_output')
+    if line.startswith(PROGRESS_PREFIX):
+        ev = parse_progress_line(line)
+        if ev is not None:
+            job.apply_progress(ev)
+            return None
+    elif line.startswith('[#'):
+        ev = parse_aria2_line(line, job.item.video_id or '')
+        if ev is not None:
+            job.apply_progress(ev)
+            return None
+    prefixed = f"[#{job.job_id}] {line}"
+    if line.startswith('ERROR:'):
+        job.error = line
+    elif line.startswith('[info] Writing video metadata'):
+        m = INFO_JSON_RE.match(line)
+        if m:
+            job.info_json = m.group(1)
+    if '[download]' in line:
+        if NET_ERROR_RE.search(line):
+            job.net_errors += 1
+            if RATE_LIMITED_RE.search(line):
+                job.rate_limited = True
+        if line.startswith('[download] Destination:'):
+            times.mark('download_start')
+        return prefixed, 'download'
+    elif any(tag in line for tag in POSTPROCESS_TAGS):
+        times.mark('postprocess_start')
+        return prefixed, 'process'
+    if NET_ERROR_RE.search(line):
+        job.net_errors += 1
+        if RATE_LIMITED_RE.search(line):
+            job.rate_limited = True
+    if times.extract_start is None:
+        m = EXTRACTOR_LINE_RE.match(line)
+        if m:
+            times.mark('extract_start')
+            job.extractor = m.group(1).split(':')[0]
+    return prefixed, ''
+
+
+class MetricsSink:
+    """Phase timings of finished items, for graphs.
+
+    Every item is appended to METRICS_FILE as one JSON line; running totals
+    are rewritten to METRICS_PROM_FILE in Prometheus text format (temp file
+    + rename, as the textfile collector expects).
+    """
+
+    PHASES = ('wait', 'spawn', 'extract', 'download', 'postprocess', 'total')
+
+    def __init__(self, path: Path = METRICS_FILE, prom_path: Path = METRICS_PROM_FILE):
+        self.path = path
+        self.prom_path = prom_path
+        self.items: dict[str, int] = {}  # result -> count
+        self.bytes = 0
+        self.phase_sum = dict.fromkeys(self.PHASES, 0.0)
+        self.phase_count = dict.fromkeys(self.PHASES, 0)
+        self.last_speed = 0.0
+        self.errors = 0
+
+    def record(self, job: DownloadJob, result: str) -> dict:
+        t = job.times
+        phases = t.phases()
+        download = phases['download']
+        speed = job.downloaded_bytes / download if download else None
+        rec = {
+            'ts': t.exited, 'job': job.job_id, 'url': job.url,
+            'video_id': job.last_event.video_id if job.last_event else job.item.video_id,
+            'format': job.item.fmt, 'backend': job.backend,
+            'result': result, 'return_code': job.return_code,
+            'bytes': job.downloaded_bytes, 'avg_speed': round(speed) if speed else None,
+            'phases': phases,
+            'times': {k: v for k, v in vars(t).items() if v is not None},
+        }
+        self.items[result] = self.items.get(result, 0) + 1
+        self.bytes += job.downloaded_bytes
+        for name, value in phases.items():
+            if value is not None:
+                self.phase_sum[name] += value
+                self.phase_count[name] += 1
+        if speed:
+            self.last_speed = speed
+        try:
+            if self.path.exists() and self.path.stat().st_size > METRICS_FILE_MAX_BYTES:
+                os.replace(self.path, self.path.with_name(self.path.name + '.1'))
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(rec, ensure_ascii=False) + '\n')
+        except OSError:
+            self.errors += 1
+        return rec
+
+    def write_prom(self, active: int, queued: int):
+        lines = [
+            '# HELP ytdlp_gui_items_total Queue items finished in this session, by result.',
+            '# TYPE ytdlp_gui_items_total counter',
+            *(f'ytdlp_gui_items_total{{result="{r}"}} {n}' for r, n in sorted(self.items.items())),
+            '# HELP ytdlp_gui_downloaded_bytes_total Bytes downloaded by finished items.',
+            '# TYPE ytdlp_gui_downloaded_bytes_total counter',
+            f'ytdlp_gui_downloaded_bytes_total {self.bytes}',
+            '# HELP ytdlp_gui_phase_seconds Time per item phase (wait, spawn, extract, download, postprocess, total).',
+            '# TYPE ytdlp_gui_phase_seconds summary',
+        ]
+        for name in self.PHASES:
+            lines.append(f'ytdlp_gui_phase_seconds_sum{{phase="{name}"}} {self.phase_sum[name]:.3f}')
+            lines.append(f'ytdlp_gui_phase_seconds_count{{phase="{name}"}} {self.phase_count[name]}')
+        lines += [
+            '# HELP ytdlp_gui_last_item_speed_bytes Average download speed of the last finished item.',
+            '# TYPE ytdlp_gui_last_item_speed_bytes gauge',
+            f'ytdlp_gui_last_item_speed_bytes {self.last_speed:.0f}',
+            '# HELP ytdlp_gui_active_jobs Downloads running now.',
+            '# TYPE ytdlp_gui_active_jobs gauge',
+            f'ytdlp_gui_active_jobs {active}',
+            '# HELP ytdlp_gui_queued_items Items waiting in the queue.',
+            '# TYPE ytdlp_gui_queued_items gauge',
+            f'ytdlp_gui_queued_items {queued}',
+        ]
+        tmp = self.prom_path.with_name(self.prom_path.name + '.tmp')
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+            os.replace(tmp, self.prom_path)
+        except OSError:
+            self.errors += 1
+
+
+class NetThreadsTuner:
+    """Picks -N per extractor/host from how earlier items went ("авто" mode).
+
+    Each finished item adds a sample (download speed, had errors or not) to
+    the level of -N it ran with; levels are AUTO_N_LEVELS. A new host starts
+    at AUTO_N_START. Once a level has AUTO_N_SAMPLES clean samples the next
+    level up is tried; the best-scoring level wins, and a level that keeps
+    erroring steps down. State lives in NET_TUNING_FILE across sessions.
+    """
+
+    def __init__(self, path: Path = NET_TUNING_FILE):
+        self.path = path
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        data = data if isinstance(data, dict) else {}
+        self.aliases: dict[str, str] = data.get('aliases') or {}  # host -> extractor
+        self.stats: dict[str, dict[str, dict]] = data.get('stats') or {}  # key -> level -> sample
+
+    def key(self, url: str, extractor: str | None = None) -> str:
+        host = url_host(url)
+        if extractor and extractor != 'generic':
+            return extractor
+        return self.aliases.get(host, host)
+
+    @staticmethod
+    def _score(sample: dict) -> float:
+        return sample['speed'] * (1.0 - sample['err'])
+
+    def choose(self, url: str) -> int:
+        levels = self.stats.get(self.key(url))
+        if not levels:
+            return AUTO_N_START
+        tried = {int(n): s for n, s in levels.items()}
+        best = max(tried, key=lambda n: self._score(tried[n]))
+        sample = tried[best]
+        if sample['err'] >= AUTO_N_MAX_ERROR:
+            lower = [n for n in AUTO_N_LEVELS if n < best]
+            return lower[-1] if lower else best
+        higher = [n for n in AUTO_N_LEVELS if n > best]
+        if higher and sample['count'] >= AUTO_N_SAMPLES:
+            up = tried.get(higher[0])
+            if up is None or (up['count'] < AUTO_N_SAMPLES and up['err'] < AUTO_N_MAX_ERROR):
+                return higher[0]  # still worth exploring
+        return best
+
+    def record(self, job: DownloadJob) -> bool:
+        """Learn from a finished item; False if it has nothing to teach."""
+        n = job_net_threads(job)
+        download = job.times.phases()['download']
+        if n is None or not (download or job.net_errors):
+            return False  # failed for reasons -N has nothing to do with
+        host = url_host(job.url)
+        key = self.key(job.url, job.extractor)
+        if key != host:
+            self.aliases[host] = key
+        sample = self.stats.setdefault(key, {}).setdefault(str(n), {'speed': 0.0, 'err': 0.0, 'count': 0})
+        err = 1.0 if job.net_errors else 0.0
+        a = AUTO_N_ALPHA if sample['count'] else 1.0
+        if download:
+            sample['speed'] = (1 - a) * sample['speed'] + a * job.downloaded_bytes / download
+        sample['err'] = (1 - a) * sample['err'] + a * err
+        sample['count'] += 1
+        try:
+            write_json_atomic(self.path, {'aliases': self.aliases, 'stats': self.stats})
+        except OSError:
+            pass
+        return True
+
+
+# ==========================
+#  In-process backend
+# ==========================
+def inprocess_available() -> bool:
+    """True if the yt_dlp package is importable (BACKEND_INPROCESS needs it)."""
+    return importlib.util.find_spec('yt_dlp') is not None
+
+
+class _PipeLogger:
+    """yt-dlp logger that sends every message to the parent as an output line."""
+
+    def __init__(self, send: Callable):
+        self.send = send
+
+    def debug(self, msg: str):
+        self.send(('line', msg + '\n'))
+
+    info = error = debug
+
+    def warning(self, msg: str):
+        self.send(('line', f"WARNING: {msg}\n"))
+
+
+def _inprocess_worker(conn):
+    """Worker process: import yt_dlp once, then run items sent by the parent.
+
+    ('run', argv, url) starts an item; argv is what the subprocess backend
+    would run minus binary and URL, so presets and checkboxes mean the same
+    thing. ('rate', bytes/s) changes the running item's rate limit. The
+    worker answers with ('line', text) and ('progress', id, fields) messages
+    and a final ('done', return code).
+    """
+    import contextlib
+    import io
+    import queue
+    import yt_dlp
+
+    send_lock = threading.Lock()  # hooks also fire from fragment threads
+
+    def send(msg):
+        with send_lock:
+            conn.send(msg)
+
+    tasks: queue.Queue = queue.Queue()
+    current: dict = {}  # 'ydl' and 'rate' of the item in progress
+
+    def read():
+        # control messages must get through while an item is downloading
+        while True:
+            try:
+                msg = conn.recv()
+            except (EOFError, OSError):
+                msg = None
+            if msg is not None and msg[0] == 'rate':
+                current['rate'] = msg[1] or None  # 0 = no limit
+                ydl = current.get('ydl')
+                if ydl is not None:
+                    ydl.params['ratelimit'] = current['rate']  # the downloaders read it per block
+                continue
+            current.clear()  # rates sent before this task belonged to the previous one
+            tasks.put(msg)
+            if msg is None:
+                return
+    threading.Thread(target=read, daemon=True).start()
+
+    logger = _PipeLogger(send)
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        _, argv, url = task
+        last_sent = 0.0
+
+        def hook(d: dict):
+            nonlocal last_sent
+            now = time.monotonic()
+            if d.get('status') == 'downloading' and now - last_sent < INPROCESS_PROGRESS_INTERVAL:
+                return
+            last_sent = now
+            video_id = (d.get('info_dict') or {}).get('id') or ''
+            send(('progress', video_id, {k: d.get(k) for k in PROGRESS_FIELDS}))
+
+        try:
+            err = io.StringIO()  # -v makes parse_options print its config to stderr
+            with contextlib.redirect_stderr(err):
+                params = yt_dlp.parse_options(argv).ydl_opts
+            for line in err.getvalue().splitlines(True):
+                send(('line', line))
+            params.update(logger=logger, progress_hooks=[hook], noprogress=True)
+            with yt_dlp.YoutubeDL(params) as ydl:
+                if current.get('rate'):
+                    ydl.params['ratelimit'] = current['rate']
+                current['ydl'] = ydl
+                rc = ydl.download([url])
+        except yt_dlp.utils.DownloadError:
+            rc = 1  # already reported through the logger
+        except SystemExit as e:  # bad option: optparse exits
+            rc = e.code if isinstance(e.code, int) else 2
+        except Exception as e:
+            send(('line', f"ERROR: {e}\n"))
+            rc = 1
+        current.pop('ydl', None)
+        send(('done', rc))
+
+
+class InProcessWorker:
+    """One warm worker process and the pipe to it."""
+
+    def __init__(self, ctx):
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_inprocess_worker, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+        self._send_lock = threading.Lock()  # job thread and host thread both send
+
+    def send(self, msg):
+        with self._send_lock:
+            self.conn.send(msg)
+
+    def set_rate(self, rate: int):
+        try:
+            self.send(('rate', rate))
+        except (OSError, ValueError):
+            pass  # worker gone; its job is finishing anyway
+
+    def alive(self) -> bool:
+        return self.process.is_alive()
+
+    def kill(self):
+        """Stop the current item right away; the worker is replaced on next use."""
+        if self.process.is_alive():
+            self.process.terminate()
+
+    def close(self):
+        self.kill()
+        self.conn.close()
+
+
+class InProcessPool:
+    """Warm yt_dlp worker processes, reused across queue items.
+
+    Workers are started on demand and returned after each item, so there are
+    never more than were busy at once (max_parallel).
+    """
+
+    def __init__(self):
+        # spawn, not fork: the parent has threads (and maybe Tk)
+        self._ctx = multiprocessing.get_context('spawn')
+        self._idle: list[InProcessWorker] = []
+        self._lock = threading.Lock()
+
+    def warm(self, n: int):
+        """Start workers ahead of time so the first items don't pay for startup."""
+        with self._lock:
+            self._idle = [w for w in self._idle if w.alive()]
+            while len(self._idle) < n:
+                self._idle.append(InProcessWorker(self._ctx))
+
+    def acquire(self) -> InProcessWorker:
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.alive():
+                    return worker
+                worker.close()
+        return InProcessWorker(self._ctx)
+
+    def release(self, worker: InProcessWorker):
+        if not worker.alive():
+            worker.close()
+            return
+        with self._lock:
+            self._idle.append(worker)
+
+    def shutdown(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.close()
+
+
+def stop_job_process(job: DownloadJob):
+    """Kill whatever runs `job`: its yt-dlp process or its in-process worker."""
+    if job.worker is not None:
+        job.worker.kill()
+    else:
+        terminate_process(job.process)
+
+
+# ==========================
+#  Queue engine
+# ==========================
+class PendingQueue:
+    """Items waiting for a download slot, in dispatch order.
+
+    The order is priority (highest first), then the expected size when `sjf`
+    is on, then position. A heap makes taking the next item O(log n) where the
+    old list paid O(n) for every pop(0). Removing or re-sorting an item only
+    marks its old heap entry dead; dead entries are dropped as they surface.
+    """
+
+    def __init__(self, sjf: bool = False):
+        self.sjf = sjf
+        self._heap: list[list] = []  # [key, seq, item]; item is None once the entry is dead
+        self._entries: dict[int, list] = {}  # QueueStore id -> live heap entry
+        self._seq = 0
+        self._head = 0.0  # lowest and highest position handed out so far
+        self._tail = 0.0
+        self.version = 0  # bumped on every change, so views know when to re-read ordered()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self):
+        """Queued items in no particular order (cheap); ordered() sorts them."""
+        return (entry[2] for entry in self._entries.values())
+
+    def ordered(self) -> list[QueueItem]:
+        return [entry[2] for entry in sorted(self._entries.values())]
+
+    def get(self, item_id: int) -> QueueItem | None:
+        entry = self._entries.get(item_id)
+        return entry[2] if entry else None
+
+    def _key(self, item: QueueItem) -> tuple:
+        return -item.priority, item.expected_size if self.sjf else 0, item.position
+
+    def _push(self, item: QueueItem):
+        self._head = min(self._head, item.position)
+        self._tail = max(self._tail, item.position)
+        self._seq += 1
+        self.version += 1
+        entry = [self._key(item), self._seq, item]
+        self._entries[item.item_id] = entry
+        heapq.heappush(self._heap, entry)
+
+    def extend(self, items: list[QueueItem]):
+        """New or restored items; without a saved position they go in journal order."""
+        for item in items:
+            if item.position is None:
+                item.position = float(item.item_id) if item.item_id is not None else self._tail + 1
+            self._push(item)
+
+    def append(self, item: QueueItem):
+        """Behind everything of the same priority (a retry)."""
+        item.position = self._tail + 1
+        self._push(item)
+
+    def appendleft(self, item: QueueItem):
+        """Ahead of everything of the same priority (a paused or backed-off item)."""
+        item.position = self._head - 1
+        self._push(item)
+
+    def pop(self, ready: Callable[[QueueItem], bool] | None = None) -> QueueItem | None:
+        """Take the first item `ready` accepts (the first item without it); None if none does."""
+        taken = self.take(ready, 1)
+        return taken[0] if taken else None
+
+    def take(self, ready: Callable[[QueueItem], bool] | None, limit: int) -> list[QueueItem]:
+        """Take up to `limit` items `ready` accepts, in order, in one pass over the heap."""
+        skipped, taken = [], []
+        while self._heap and len(taken) < limit:
+            entry = heapq.heappop(self._heap)
+            item = entry[2]
+            if item is None:
+                continue
+            if ready is None or ready(item):
+                del self._entries[item.item_id]
+                self.version += 1
+                taken.append(item)
+            else:
+                skipped.append(entry)
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+        return taken
+
+    def remove(self, item_id: int) -> QueueItem | None:
+        entry = self._entries.pop(item_id, None)
+        if entry is None:
+            return None
+        item, entry[2] = entry[2], None
+        self.version += 1
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._rebuild()
+        return item
+
+    def update(self, item: QueueItem):
+        """Re-sort `item` after its priority, position or size changed."""
+        if self.remove(item.item_id) is not None:
+            self._push(item)
+
+    def move(self, item_id: int, index: int) -> QueueItem | None:
+        """Put an item at `index` of ordered(); it takes the priority of the item it lands
+        before (after, at the end). With `sjf` on the size still orders a priority."""
+        item = self.get(item_id)
+        if item is None:
+            return None
+        order = [i for i in self.ordered() if i is not item]
+        index = max(0, min(index, len(order)))
+        prev = order[index - 1] if index > 0 else None
+        nxt = order[index] if index < len(order) else None
+        if nxt is not None:
+            item.priority = nxt.priority
+            if prev is not None and prev.priority == nxt.priority:
+                item.position = (prev.position + nxt.position) / 2
+            else:
+                item.position = nxt.position - 1
+        elif prev is not None:
+            item.priority = prev.priority
+            item.position = prev.position + 1
+        self.update(item)
+        return item
+
+    def set_sjf(self, on: bool):
+        if on != self.sjf:
+            self.sjf = on
+            self._rebuild()
+
+    def _rebuild(self):
+        self.version += 1
+        for entry in self._entries.values():
+            entry[0] = self._key(entry[2])
+        self._heap = list(self._entries.values())
+        heapq.heapify(self._heap)
+
+    def clear(self):
+        self._heap.clear()
+        self._entries.clear()
+        self.version += 1
+
+
+@dataclass
+class HostLane:
+    """Scheduling state of one site: rate-limit backoff, cache warm-up."""
+    strikes: int = 0  # rate-limited items in a row
+    paused_until: float = 0.0  # time.monotonic()
+    warming: bool = False  # YtdlpCache.warm() running: hold the site's items
+
+
+class QueueEngine:
+    """The download queue without any UI: journal, dedupe, N parallel workers.
+
+    Worker threads only touch `buffer` and their own job's progress fields.
+    Everything else runs in pump() and the public methods, which the host
+    (the Tk tick or the headless loop) calls from one thread. Hosts plug in
+    through the on_* callbacks.
+    """
+
+    def __init__(self, store: QueueStore | None = None, index: DownloadIndex | None = None,
+                 playlists: PlaylistResolver | None = None):
+        self.store = store or QueueStore()
+        self.index = index or DownloadIndex()
+        self.playlists = playlists or PlaylistResolver()
+        self.formats = FormatProber()
+        self.validator = UrlValidator()
+        self.cache = YtdlpCache()
+        self.cache_warmup = True  # warm the yt-dlp cache per site at queue start
+        self.buffer = OutputBuffer()
+        self.max_parallel = DEFAULT_MAX_PARALLEL
+        self.batch_items = DEFAULT_BATCH_ITEMS  # compatible items per yt-dlp process
+        self.backend = BACKEND_SUBPROCESS
+        self.pool = InProcessPool()
+        self.metrics = MetricsSink()
+        self.total_rate: int | None = None  # bytes/s shared by all running jobs
+        self.auto_threads = False  # pick -N per host with `tuner` instead of the item's value
+        self.tuner = NetThreadsTuner()
+        self.host_limit = DEFAULT_HOST_PARALLEL  # items per site in flight, 0 = no cap
+        self.lanes: dict[str, HostLane] = {}
+        self._rate_strikes: dict[int, int] = {}  # QueueStore id -> rate-limited attempts
+        self.max_retries = DEFAULT_RETRIES
+        self._retries: dict[int, int] = {}  # QueueStore id -> automatic retries so far
+        self._not_before: dict[int, float] = {}  # QueueStore id -> monotonic time of the next attempt
+        self.failed_items: list[QueueItem] = []  # final failures of the current run
+        self.post_parallel = POSTPROCESS_PARALLEL  # 0 = post-process inside the download slot
+        self.post_queue: list[DownloadJob] = []  # downloaded, waiting for a post-processing slot
+        self.post_active: dict[int, DownloadJob] = {}
+        self._wakeup: float | None = None  # earliest end of a lane pause or retry delay
+        self._slot_freed: float | None = None  # exit time of the job being replaced
+
+        self.queue = PendingQueue()
+        self.active: dict[int, DownloadJob] = {}
+        self.finished: list[DownloadJob] = []  # newest last, capped at LOG_KEEP_FILES
+        self.running = False
+        self.stop_requested = False
+        self.keep_alive = False  # host may still add items: don't end the run when idle
+        self.pending_resolves = 0  # playlists still being expanded in the background
+        self.resolve_queue: list[tuple[str, list[str], str]] = []  # waiting for a resolver slot
+        self.resolving = 0
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.last_output_dir: str | None = None
+        self._job_seq = 0
+
+        # host callbacks
+        self.on_log: Callable[[list[tuple[str, str]]], None] = lambda lines: None
+        self.on_job_started: Callable[[DownloadJob], None] = lambda job: None
+        self.on_job_finished: Callable[[DownloadJob], None] = lambda job: None
+        self.on_queue_finished: Callable[[bool], None] = lambda stopped: None
+        self.on_error: Callable[[str, str], None] = lambda title, message: None
+        self.on_formats: Callable[[str, dict | RuntimeError], None] = lambda url, info: None
+
+    def log(self, text: str, tag: str = ''):
+        self.on_log([(text, tag)])
+
+    @property
+    def idle(self) -> bool:
+        return not self.running and not self.active and not self.post_active and not self.pending_resolves
+
+    # ---------- Queue ----------
+    def restore(self) -> int:
+        """Load what the previous session left unfinished; returns how many were interrupted."""
+        try:
+            items, interrupted = self.store.recover()
+        except (sqlite3.Error, ValueError) as e:
+            self.log(f"Не удалось прочитать журнал очереди: {e}\n", 'error')
+            return 0
+        if items:
+            self.queue.extend(items)
+            self.log(f"Восстановлено из журнала: {len(items)} (прервано: {interrupted})\n", 'queue')
+        return interrupted
+
+    def clear(self):
+        self.queue.clear()
+        self._not_before.clear()
+        self.store.clear_pending()
+        self.log("Очередь очищена\n", 'queue')
+
+    def add_url(self, url: str, options: DownloadOptions, final_dir: str):
+        """Queue one URL; playlists are expanded in the background first."""
+        os.makedirs(final_dir, exist_ok=True)
+        base_cmd = build_command(options, final_dir, self.index.archive_path(final_dir, options.output_key))
+        if options.playlist_all:
+            # expand in the background; every video becomes its own queue item
+            self._resolve_playlist(url, base_cmd, final_dir)
+            return
+        if self.enqueue([QueueItem(url, base_cmd + [url], final_dir, video_id=video_id_from_url(url))]):
+            self.log(f"Добавлено в очередь: {url}\n", 'queue')
+
+    def add_urls(self, urls: list[str], options: DownloadOptions, final_dir: str):
+        """Queue many URLs at once: one command build, one makedirs, one journal transaction."""
+        if not urls:
+            return
+        os.makedirs(final_dir, exist_ok=True)
+        base_cmd = build_command(options, final_dir, self.index.archive_path(final_dir, options.output_key))
+        if options.playlist_all:
+            for url in urls:
+                self._resolve_playlist(url, base_cmd, final_dir)
+            return
+        added = self.enqueue([QueueItem(url, base_cmd + [url], final_dir, video_id=video_id_from_url(url))
+                              for url in urls])
+        self.log(f"Добавлено в очередь: {len(added)} из {len(urls)}\n", 'queue')
+
+    def import_urls(self, text: str, options: DownloadOptions, final_dir: str):
+        """Bulk import from pasted text or a file's contents.
+
+        Parsing, normalisation and the extractor check run on a worker thread;
+        the result is queued through add_urls on the host thread.
+        """
+        def run():
+            urls = parse_url_list(text)
+            unknown = self.validator.unknown(urls)
+            self.buffer.post(self._on_urls_imported, urls, unknown, options, final_dir)
+        threading.Thread(target=run, daemon=True).start()
+
+    def _on_urls_imported(self, urls: list[str], unknown: list[str], options: DownloadOptions, final_dir: str):
+        if not urls:
+            self.log("Импорт: ссылок не найдено\n", 'error')
+            return
+        if unknown:
+            # the generic extractor may still handle them (direct links, embeds)
+            self.log(f"Импорт: не подходят ни к одному извлекателю — {len(unknown)} "
+                     f"(например {unknown[0]})\n", 'error')
+        self.add_urls(urls, options, final_dir)
+
+    def enqueue(self, items: list[QueueItem]) -> list[QueueItem]:
+        """Journal and queue `items`, dropping known downloads and duplicates."""
+        queued = [*self.queue, *(job.item for job in (*self.active.values(), *self.post_queue, *self.post_active.values()))]
+        seen = {(i.final_dir, i.output_key, i.video_id or i.url) for i in queued}
+        fresh, skipped = [], 0
+        for item in items:
+            key = (item.final_dir, item.output_key, item.video_id or item.url)
+            if key in seen or (item.video_id and self.index.contains(item.final_dir, item.output_key, item.video_id)):
+                skipped += 1
+                continue
+            seen.add(key)
+            if item.duration is None and item.filesize is None:
+                self._fill_size(item)
+            fresh.append(item)
+        if skipped:
+            self.log(f"Пропущено (уже скачано или уже в очереди): {skipped}\n", 'queue')
+        if not fresh:
+            return fresh
+        self.queue.extend(self.store.add_many(fresh))
+        if self.running:
+            # late additions join the running queue and may take a free slot
+            self.total += len(fresh)
+            self._dispatch()
+        return fresh
+
+    def _fill_size(self, item: QueueItem):
+        """Duration and size estimate for shortest-job-first, from a cached format probe."""
+        info = self.formats.cached(item.url)
+        if not info:
+            return
+        item.duration = info.get('duration')
+        picks = match_format(item.fmt, info.get('formats') or [])
+        if picks:
+            item.filesize = estimate_size(picks, item.duration)
+
+    # ---------- Ordering ----------
+    def set_sjf(self, on: bool):
+        """Shortest-job-first within each priority, instead of queue order."""
+        self.queue.set_sjf(on)
+
+    def set_priority(self, item_id: int, priority: int) -> bool:
+        item = self.queue.get(item_id)
+        if item is None:
+            return False  # already running or finished
+        item.priority = priority
+        self.queue.update(item)
+        self.store.set_order([item])
+        return True
+
+    def move(self, item_id: int, index: int) -> bool:
+        """Manual reorder: put a pending item at `index` of queue.ordered()."""
+        item = self.queue.move(item_id, index)
+        if item is None:
+            return False
+        self.store.set_order([item])
+        return True
+
+    def _resolve_playlist(self, url: str, base_cmd: list[str], final_dir: str):
+        self.pending_resolves += 1
+        self.log(f"Разбор плейлиста: {url}\n", 'queue')
+        self.resolve_queue.append((url, base_cmd, final_dir))
+        self._start_resolves()
+
+    def _start_resolves(self):
+        """Expand queued playlists, at most `parallel_limit` yt-dlp calls at a time."""
+        while self.resolve_queue and self.resolving < self.parallel_limit:
+            url, base_cmd, final_dir = self.resolve_queue.pop(0)
+            self.resolving += 1
+
+            def run(url=url, base_cmd=base_cmd, final_dir=final_dir):
+                try:
+                    result = self.playlists.resolve(url)
+                except RuntimeError as e:
+                    result = e
+                self.buffer.post(self._on_playlist_resolved, url, base_cmd, final_dir, result)
+            threading.Thread(target=run, daemon=True).start()
+
+    def _on_playlist_resolved(self, url: str, base_cmd: list[str], final_dir: str,
+                              result: list[dict] | RuntimeError):
+        self.pending_resolves -= 1
+        self.resolving -= 1
+        self._start_resolves()
+        if isinstance(result, RuntimeError) or not result:
+            # single video, or extraction failed: one opaque item, as before
+            cmd = [a if a != '--no-playlist' else '--yes-playlist' for a in base_cmd] + [url]
+            added = self.enqueue([QueueItem(url, cmd, final_dir, video_id=video_id_from_url(url))])
+            if isinstance(result, RuntimeError):
+                self.log(f"Не удалось разобрать плейлист ({result}), добавлен целиком: {url}\n", 'error')
+            elif added:
+                self.log(f"Добавлено в очередь: {url}\n", 'queue')
+        else:
+            added = self.enqueue([QueueItem(e['url'], base_cmd + [e['url']], final_dir, video_id=e.get('id'),
+                                            duration=e.get('duration'))
+                                  for e in result])
+            self.log(f"Плейлист: добавлено {len(added)} из {len(result)} видео ({url})\n", 'queue')
+        self._dispatch()  # the run may have been waiting only for this playlist
+
+    def probe_formats(self, url: str):
+        """Fetch the format list of `url` in the background; the result goes to on_formats."""
+        info = self.formats.cached(url)
+        if info is not None:
+            self.on_formats(url, info)
+            return
+
+        def run():
+            try:
+                result = self.formats.probe(url)
+            except RuntimeError as e:
+                result = e
+            self.buffer.post(self.on_formats, url, result)
+        threading.Thread(target=run, daemon=True).start()
+
+    # ---------- Run control ----------
+    def start(self) -> bool:
+        if self.running:
+            return False
+        self.running = True
+        self.stop_requested = False
+        self.total = len(self.queue)
+        self.done = self.failed = 0
+        self.failed_items = []
+        if self.backend == BACKEND_INPROCESS:
+            if inprocess_available():
+                self.pool.warm(min(max(1, self.total), self.max_parallel, MAX_PARALLEL_LIMIT))
+            else:
+                self.log("Модуль yt_dlp не установлен, используется внешний yt-dlp\n", 'error')
+                self.backend = BACKEND_SUBPROCESS
+        self.log(f"\n--- ЗАПУСК ОЧЕРЕДИ (параллельно: {self.max_parallel}) ---\n", 'info')
+        threading.Thread(target=self._cache_maintenance, daemon=True).start()
+        if self.cache_warmup:
+            self._warm_cache()
+        self._dispatch()
+        return True
+
+    def _warm_cache(self):
+        """Hold back the busiest sites until one extraction has filled the yt-dlp cache.
+
+        Only sites that would run several items at once are worth it; with one
+        item in flight the first job fills the cache just as well.
+        """
+        per_site = self.host_limit or self.parallel_limit
+        counts: dict[str, list] = {}
+        for item in self.queue:
+            entry = counts.setdefault(host_lane(item.url), [0, item.url])
+            entry[0] += 1
+        busiest = sorted(counts.items(), key=lambda kv: -kv[1][0])[:YTDLP_CACHE_WARM_SITES]
+        for site, (count, url) in busiest:
+            if min(count, per_site, self.parallel_limit) < 2 or not self.cache.needs_warmup(site):
+                continue
+            self.lanes.setdefault(site, HostLane()).warming = True
+            self.log(f"Прогрев кэша yt-dlp: {site}\n", 'queue')
+
+            def run(site=site, url=url):
+                self.buffer.post(self._on_cache_warmed, site, self.cache.warm(site, url))
+            threading.Thread(target=run, daemon=True).start()
+
+    def _on_cache_warmed(self, site: str, seconds: float):
+        self.lanes.setdefault(site, HostLane()).warming = False
+        self.log(f"Кэш yt-dlp прогрет: {site} за {seconds:.1f} с\n", 'queue')
+        self._dispatch()
+
+    def _cache_maintenance(self):
+        """Worker thread: cap the cache size, then report what it holds."""
+        freed = self.cache.evict()
+        self.buffer.put(format_cache_stats(self.cache.stats(), freed) + '\n', 'queue')
+
+    def stop_all(self):
+        """Stop every running worker and pause the queue (pending items are kept)."""
+        if not self.running:
+            return
+        self.stop_requested = True
+        for job in self.post_queue:
+            job.stopped = True
+        for job in (*self.active.values(), *self.post_active.values()):
+            job.stopped = True
+            stop_job_process(job)
+        self.log("\n--- ОСТАНОВЛЕНО ПОЛЬЗОВАТЕЛЕМ ---\n", 'error')
+        self._dispatch_post()  # waiting post jobs are requeued without running
+        if not self.active and not self.post_active:
+            self._dispatch()  # only delayed items were left: end the run now
+
+    def stop_job(self, job_id: int):
+        """Stop a single worker; the queue moves on to the next item."""
+        job = self.active.get(job_id) or self.post_active.get(job_id)
+        if job is None:
+            job = next((j for j in self.post_queue if j.job_id == job_id), None)
+        if not job or job.stopped:
+            return
+        job.stopped = True
+        if job.batch is not None and job.stage == 'download':
+            job.batch.killed = True  # the other unfinished members go back to the queue
+        stop_job_process(job)
+        self.log(f"\n--- #{job_id} ОСТАНОВЛЕНО ПОЛЬЗОВАТЕЛЕМ ---\n", 'error')
+        self._dispatch_post()
+
+    def shutdown(self):
+        """Host is exiting: kill workers; their items stay 'running' and resume next start."""
+        self.stop_requested = True
+        for job in (*self.active.values(), *self.post_active.values()):
+            job.stopped = True
+            stop_job_process(job)
+        self.close()
+
+    def close(self):
+        """Release the worker pool and the journal."""
+        self.pool.shutdown()
+        self.store.close()
+
+    def pump(self):
+        """Host tick: deliver buffered output, then results posted by worker threads."""
+        lines, calls = self.buffer.drain()
+        if lines:
+            self.on_log(lines)
+        for fn, args in calls:
+            fn(*args)
+        if self._wakeup is not None and time.monotonic() >= self._wakeup:
+            self._wakeup = None
+            self._dispatch()  # a paused host lane has reopened
+
+    @property
+    def parallel_limit(self) -> int:
+        return max(1, min(MAX_PARALLEL_LIMIT, self.max_parallel))
+
+    def set_total_rate(self, rate: int | None):
+        """Change the total budget; running in-process jobs follow right away."""
+        self.total_rate = rate
+        self._rebalance()
+        self._dispatch()  # a bigger budget may have room for more jobs
+
+    def _rebalance(self, starting: DownloadJob | None = None):
+        """Split total_rate among running jobs.
+
+        A yt-dlp process keeps the --limit-rate it was started with, so a
+        starting subprocess job gets what the other processes leave, divided
+        by the slots still to fill that can get RATE_MIN; the last one that
+        fits takes all that is left. In-process jobs share the rest equally
+        and are updated live whenever a job starts or finishes. Shares never
+        add up to more than total_rate: _dispatch only starts a job while
+        RATE_MIN is left for it (_rate_room).
+        """
+        jobs = self._processes()
+        if not self.total_rate:
+            for job in jobs:
+                if job.rate_limit and job.worker is not None:
+                    job.worker.set_rate(item_rate(job.item) or 0)  # 0 = no limit
+                job.rate_limit = None
+            return
+        fixed = [j for j in jobs if j.backend == BACKEND_SUBPROCESS and j is not starting]
+        live = [j for j in jobs if j.backend == BACKEND_INPROCESS]
+        remaining = self.total_rate - sum(j.rate_limit or 0 for j in fixed)
+        if starting is not None and starting.backend == BACKEND_SUBPROCESS:
+            planned = min(self.parallel_limit, len(jobs) + len(self.queue))
+            fits = (remaining - RATE_MIN * len(live)) // RATE_MIN  # processes _rate_room would still admit
+            share = remaining // max(1, min(planned - len(fixed), fits))
+            rate = max(RATE_MIN, min(share, item_rate(starting.item) or share))
+            starting.rate_limit = max(1, min(rate, remaining - RATE_MIN * len(live)))
+            remaining -= starting.rate_limit
+        if not live:
+            return
+        share = max(1, remaining // len(live))
+        for job in live:
+            rate = min(share, item_rate(job.item) or share)
+            if job.rate_limit != rate:
+                job.rate_limit = rate
+                if job.worker is not None:
+                    job.worker.set_rate(rate)
+
+    def _rate_room(self) -> bool:
+        """Whether total_rate leaves RATE_MIN for one more process; the first one always runs."""
+        jobs = self._processes()
+        if not self.total_rate or not jobs:
+            return True
+        fixed = sum(j.rate_limit or 0 for j in jobs if j.backend == BACKEND_SUBPROCESS)
+        live = sum(1 for j in jobs if j.backend == BACKEND_INPROCESS)
+        return self.total_rate - fixed >= RATE_MIN * (live + 1)
+
+    def _processes(self) -> list[DownloadJob]:
+        """One running job per yt-dlp process or worker: batch members share one."""
+        return list({id(job.batch or job): job for job in self.active.values()}.values())
+
+    def _dispatch(self):
+        """Keep up to `max_parallel` workers busy; end the run once everything drained."""
+        if not self.running:
+            return
+        if not self.stop_requested:
+            while self.queue and len(self._processes()) < self.parallel_limit and self._rate_room():
+                now = time.monotonic()
+                blocked = self._blocked_lanes(now)
+                item = self._next_item(blocked, now)
+                if item is None:
+                    break  # every queued host is paused or at its cap
+                batch = self._batch_for(item, blocked, now)
+                if batch:
+                    self._start_batch([item, *batch])
+                else:
+                    self._start_job(item)
+        # queued items of paused hosts keep the run alive; pump() wakes it up
+        if self.active or self.post_active or self.post_queue or (
+                not self.stop_requested and (self.pending_resolves or self.keep_alive or self.queue)):
+            return
+
+        self.running = False
+        if self.stop_requested:
+            self.log(f"\n--- ОЧЕРЕДЬ ПРИОСТАНОВЛЕНА (осталось: {len(self.queue)}) ---\n", 'info')
+        else:
+            self.log("\n--- ОЧЕРЕДЬ ЗАВЕРШЕНА ---\n", 'info')
+        self.on_queue_finished(self.stop_requested)
+
+    def _blocked_lanes(self, now: float) -> set[str]:
+        """Host lanes nothing may be started on: paused, warming up, pushing
+        back (rate limited) or at host_limit."""
+        busy: dict[str, int] = {}
+        for job in self._processes():
+            lane = host_lane(job.url)
+            busy[lane] = busy.get(lane, 0) + 1
+        for job in self.active.values():
+            if job.rate_limited:  # pushing back right now: don't add to it
+                busy[host_lane(job.url)] = MAX_PARALLEL_LIMIT
+        blocked = {lane for lane, n in busy.items() if self.host_limit and n >= self.host_limit}
+        blocked.update(lane for lane, st in self.lanes.items() if st.paused_until > now or st.warming)
+        return blocked
+
+    def _next_item(self, blocked: set[str], now: float) -> QueueItem | None:
+        """Take the first queued item that is not waiting for a retry and whose
+        host lane is not `blocked`."""
+        if not blocked and not self._not_before:
+            return self.queue.pop()
+        item = self.queue.pop(lambda i: self._not_before.get(i.item_id, 0.0) <= now
+                              and host_lane(i.url) not in blocked)
+        if item is not None:
+            self._not_before.pop(item.item_id, None)
+        return item
+
+    def _batch_for(self, item: QueueItem, blocked: set[str], now: float) -> list[QueueItem]:
+        """Take pending items that can share `item`'s yt-dlp process: same argv but
+        the URL, same host lane and same priority, so a batch never starts anything
+        _next_item would have held back or passed over.
+
+        Batches only grow as far as the queue allows without leaving slots
+        idle: each slot gets about len(queue) / parallel_limit items.
+        """
+        if self.backend != BACKEND_SUBPROCESS or '--yes-playlist' in item.command:
+            return []  # a playlist URL expands into videos the batch can't attribute
+        extra = min(self.batch_items, -(-(len(self.queue) + 1) // self.parallel_limit)) - 1
+        if extra <= 0:
+            return []
+        args, lane = item.command[:-1], host_lane(item.url)
+        if lane in blocked:
+            return []
+        return self.queue.take(lambda i: i.priority == item.priority and i.command[:-1] == args
+                               and host_lane(i.url) == lane and self._not_before.get(i.item_id, 0.0) <= now,
+                               extra)
+
+    def _wake_at(self, when: float):
+        if self._wakeup is None or when < self._wakeup:
+            self._wakeup = when
+
+    def _retry(self, job: DownloadJob) -> bool:
+        """Failed item: put it back at the end of the queue after a delay.
+        False if the error is permanent or the item is out of retries."""
+        if job.error and PERMANENT_ERROR_RE.search(job.error):
+            return False
+        attempt = self._retries.get(job.item.item_id, 0) + 1
+        if attempt > self.max_retries:
+            return False
+        self._retries[job.item.item_id] = attempt
+        delay = min(RETRY_MAX_DELAY, RETRY_BASE * 2 ** (attempt - 1))
+        self._not_before[job.item.item_id] = time.monotonic() + delay
+        self._wake_at(time.monotonic() + delay)
+        self.store.set_state(job.item, 'pending')
+        self.queue.append(job.item)
+        self.log(f"\n--- #{job.job_id} ОШИБКА: Код {job.return_code}, повтор через {delay:.0f} с "
+                 f"(попытка {attempt}/{self.max_retries}) ---\n", 'error')
+        return True
+
+    def _back_off(self, job: DownloadJob) -> bool:
+        """Rate-limited item: pause its host and requeue it. False once out of retries."""
+        strikes = self._rate_strikes.get(job.item.item_id, 0) + 1
+        if strikes > HOST_BACKOFF_RETRIES:
+            self._rate_strikes.pop(job.item.item_id, None)
+            return False
+        self._rate_strikes[job.item.item_id] = strikes
+        name = host_lane(job.url)
+        lane = self.lanes.setdefault(name, HostLane())
+        lane.strikes += 1
+        delay = min(HOST_BACKOFF_MAX, HOST_BACKOFF_BASE * 2 ** (lane.strikes - 1))
+        lane.paused_until = max(lane.paused_until, time.monotonic() + delay)
+        self._wake_at(lane.paused_until)
+        self.store.set_state(job.item, 'pending')
+        self.queue.appendleft(job.item)
+        self.log(f"\n--- #{job.job_id} {name}: сайт ограничивает запросы, пауза {delay:.0f} с "
+                 f"(попытка {strikes}/{HOST_BACKOFF_RETRIES}) ---\n", 'error')
+        return True
+
+    # ---------- Workers ----------
+    def _new_job(self, item: QueueItem, backend: str) -> DownloadJob:
+        self._job_seq += 1
+        job = DownloadJob(self._job_seq, item, backend=backend)
+        job.split_post = self.post_parallel > 0 and bool(split_postprocess(item.command)[1])
+        job.log_path = LOGS_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}_{job.job_id:04d}.log"
+        return job
+
+    def _start_job(self, item: QueueItem):
+        job = self._new_job(item, self.backend)
+        job.times.mark('dispatched')
+        job.times.slot_freed, self._slot_freed = self._slot_freed, None
+        if self.auto_threads:
+            job.net_threads = self.tuner.choose(item.url)
+        self.active[job.job_id] = job
+        self._rebalance(starting=job)
+        self.store.set_state(item, 'running')
+        self.last_output_dir = item.final_dir
+        self.log(f"\n--- #{job.job_id} Загрузка: {item.url} ---\n", 'info')
+        self.log(f"Команда: {' '.join(job.command)}\n")
+        self.on_job_started(job)
+        threading.Thread(target=self._run_job, args=(job,), daemon=True).start()
+
+    def _start_batch(self, items: list[QueueItem]):
+        """One subprocess for several items; each still gets its own job, log and outcome."""
+        jobs = [self._new_job(item, BACKEND_SUBPROCESS) for item in items]
+        lead = jobs[0]
+        batch = BatchRun(jobs, BATCH_DIR / f"batch_{lead.job_id:04d}.txt")
+        lead.times.mark('dispatched')
+        lead.times.slot_freed, self._slot_freed = self._slot_freed, None
+        if self.auto_threads:
+            lead.net_threads = self.tuner.choose(lead.url)
+        lead.batch = batch
+        self.active[lead.job_id] = lead
+        self._rebalance(starting=lead)  # one process, one share of the total rate
+        for job in jobs:
+            job.batch = batch
+            job.rate_limit, job.net_threads = lead.rate_limit, lead.net_threads
+            self.active[job.job_id] = job
+            self.store.set_state(job.item, 'running')
+        self.last_output_dir = lead.final_dir
+        self.log(f"\n--- #{lead.job_id}–#{jobs[-1].job_id} Пакет из {len(jobs)}: {lead.url} … ---\n", 'info')
+        self.log(f"Команда: {' '.join(batch_command(lead.command, batch.path))}\n")
+        for job in jobs:
+            self.on_job_started(job)
+        threading.Thread(target=self._run_batch, args=(batch,), daemon=True).start()
+
+    def _run_batch(self, batch: BatchRun):
+        """Worker thread: run the batch's yt-dlp and split its output among the members."""
+        jobs = batch.jobs
+        by_url = {job.url: job for job in jobs}
+        by_id = {job.item.video_id: job for job in jobs if job.item.video_id}
+        logs: dict[int, ItemLog | None] = {}
+        done: set[int] = set()
+        current = jobs[0]
+
+        def item_log(job: DownloadJob) -> ItemLog | None:
+            if job.job_id not in logs:
+                try:
+                    logs[job.job_id] = ItemLog(job.log_path)
+                    logs[job.job_id].write(f"URL: {job.url}\nПакет: {' '.join(batch_command(jobs[0].command, batch.path))}\n\n")
+                except OSError as e:
+                    logs[job.job_id] = None
+                    self.buffer.put(f"[#{job.job_id}] Не удалось открыть лог-файл: {e}\n", 'error')
+            return logs[job.job_id]
+
+        def finish(job: DownloadJob, return_code: int | None):
+            """Hand a member to the host: its outcome, or None to requeue it untouched."""
+            done.add(job.job_id)
+            job.times.mark('exited')
+            log = logs.pop(job.job_id, None)
+            if log:
+                log.write(f"\n[exit code {return_code}]\n" if return_code is not None else "\n[в очередь]\n")
+                log.close()
+            if return_code is None:
+                self.buffer.post(self._requeue, job)
+            else:
+                self.buffer.post(self._finish_job, job, return_code)
+
+        try:
+            try:
+                os.makedirs(BATCH_DIR, exist_ok=True)
+                write_url_file(batch.path, [job.url for job in jobs])
+                startupinfo = None
+                if sys.platform.startswith('win'):
+                    startupinfo = subprocess.STARTUPINFO()
+                    startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+                process = subprocess.Popen(batch_command(jobs[0].command, batch.path), stdout=subprocess.PIPE,
+                                           stderr=subprocess.STDOUT, text=True, bufsize=1,
+                                           encoding='utf-8', errors='replace', startupinfo=startupinfo)
+            except (OSError, subprocess.SubprocessError) as e:
+                self.buffer.post(self._report_error, "Критическая ошибка", f"Ошибка выполнения: {e}")
+                for job in jobs:
+                    finish(job, -1)
+                return
+            current.times.mark('spawned')
+            for job in jobs:
+                job.process = process
+            if any(job.stopped for job in jobs):  # stop pressed before the process existed
+                terminate_process(process)
+
+            for raw in iter(process.stdout.readline, ''):
+                line = raw.replace('\r', '')
+                m = EXTRACTING_URL_RE.match(line)
+                if m:
+                    nxt = by_url.get(m.group(1))
+                    if nxt is None or nxt.job_id in done:  # URL rewritten by yt-dlp: next one in file order
+                        nxt = next((j for j in jobs[jobs.index(current) + 1:] if j.job_id not in done), current)
+                    if nxt is not current:
+                        # everything before it is over: finished, failed, or skipped (archive)
+                        for job in jobs[:jobs.index(nxt)]:
+                            if job.job_id not in done:
+                                finish(job, 1 if job.error else 0)
+                        current = nxt
+                        current.times.mark('dispatched')
+                        current.times.mark('spawned')
+                target = current
+                if line.startswith(PROGRESS_PREFIX):
+                    target = by_id.get(line[len(PROGRESS_PREFIX):].split(' ', 1)[0], current)
+                elif line.startswith('ERROR:'):
+                    m = ERROR_ID_RE.match(line)
+                    target = (by_id.get(m.group(1)) if m else None) or next(
+                        (j for j in jobs if j.url in line), current)
+                if target.job_id in done:
+                    target = current
+                self._handle_line(target, line, item_log(target))
+            process.wait()
+            return_code = process.returncode
+
+            # with --no-abort-on-error yt-dlp exits 1 when any member failed: that
+            # code is explained by their ERROR lines, anything else is a crash
+            explained = return_code == 1 and any(job.error for job in jobs)
+            for job in jobs:
+                if job.job_id in done:
+                    continue
+                if job.stopped:
+                    finish(job, return_code or -1)  # the usual stop/pause handling
+                elif batch.killed:
+                    finish(job, None)  # taken down with a stopped member
+                elif job.error:
+                    finish(job, return_code or 1)
+                elif job is current:
+                    finish(job, 0 if explained else return_code)  # a crash mid-item is its failure
+                elif return_code == 0:
+                    finish(job, 0)  # passed over cleanly: skipped by the archive
+                else:
+                    finish(job, None)  # yt-dlp died before getting to it
+        finally:
+            for log in logs.values():
+                if log:
+                    log.close()
+            try:
+                os.remove(batch.path)
+            except OSError:
+                pass
+
+    def _requeue(self, job: DownloadJob):
+        """Batch member yt-dlp never got to: back to the head of the queue, no attempt counted."""
+        self.active.pop(job.job_id, None)
+        self._rebalance()
+        self.store.set_state(job.item, 'pending')
+        self.queue.appendleft(job.item)
+        self.on_job_finished(job)
+        self._dispatch()
+
+    def _run_job(self, job: DownloadJob):
+        """Worker thread: run one item and stream its output to the buffer."""
+        item_log = None
+        try:
+            item_log = ItemLog(job.log_path)
+            item_log.write(f"URL: {job.url}\nКоманда: {' '.join(job.command)}\n\n")
+        except OSError as e:
+            self.buffer.put(f"[#{job.job_id}] Не удалось открыть лог-файл: {e}\n", 'error')
+        try:
+            run = self._run_inprocess if job.backend == BACKEND_INPROCESS else self._run_subprocess
+            return_code = run(job, item_log)
+            job.times.mark('exited')
+            if item_log:
+                item_log.write(f"\n[exit code {return_code}]\n")
+            self.buffer.post(self._finish_job, job, return_code)
+        except FileNotFoundError:
+            job.times.mark('exited')
+            self.buffer.post(self._report_error, "Критическая ошибка", f"'{YTDLP_BIN}' не найден. Убедитесь, что yt-dlp в PATH.")
+            self.buffer.post(self._finish_job, job, -1)
+        except Exception as e:
+            job.times.mark('exited')
+            self.buffer.post(self._report_error, "Критическая ошибка", f"Ошибка выполнения: {e}")
+            self.buffer.post(self._finish_job, job, -1)
+        finally:
+            if item_log:
+                item_log.close()
+
+    def _handle_line(self, job: DownloadJob, line: str, item_log: ItemLog | None):
+        if item_log:
+            item_log.write(line)
+        entry = classify_line(job, line)
+        if entry:
+            self.buffer.put(*entry)
+
+    def _run_subprocess(self, job: DownloadJob, item_log: ItemLog | None, command: list[str] | None = None) -> int:
+        startupinfo = None
+        if sys.platform.startswith('win'):
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+
+        job.process = subprocess.Popen(
+            command or job.command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+            encoding='utf-8',
+            errors='replace',
+            startupinfo=startupinfo
+        )
+        job.times.mark('spawned')
+        if job.stopped:  # stop pressed before the process existed
+            terminate_process(job.process)
+
+        for raw in iter(job.process.stdout.readline, ''):
+            if raw is None:
+                break
+            self._handle_line(job, raw.replace('\r', ''), item_log)  # yt-dlp uses carriage returns
+
+        job.process.wait()
+        return job.process.returncode
+
+    def _run_inprocess(self, job: DownloadJob, item_log: ItemLog | None) -> int:
+        """Hand the item to a warm worker; progress arrives as hook data, not text."""
+        worker = self.pool.acquire()
+        job.worker = worker
+        if job.stopped:
+            worker.kill()
+        try:
+            worker.send(('run', job.command[1:-1], job.url))
+            job.times.mark('spawned')
+            if job.rate_limit:
+                worker.set_rate(job.rate_limit)  # a rebalance may have raced the task
+            while True:
+                kind, *payload = worker.conn.recv()
+                if kind == 'line':
+                    for line in payload[0].splitlines(True):  # tracebacks come as one message
+                        self._handle_line(job, line, item_log)
+                elif kind == 'progress':
+                    job.apply_progress(progress_event(*payload))
+                elif kind == 'done':
+                    break
+        except (EOFError, OSError):
+            # the worker was killed (stop) or crashed mid-item
+            worker.process.join(5)
+            worker.close()
+            return worker.process.exitcode if worker.process.exitcode is not None else -1
+        finally:
+            job.worker = None
+        self.pool.release(worker)
+        return payload[0]
+
+    # ---------- Post-processing ----------
+    def _dispatch_post(self):
+        """Keep up to `post_parallel` post-processing runs busy."""
+        stopped = [job for job in self.post_queue if job.stopped]
+        if stopped:
+            self.post_queue = [job for job in self.post_queue if not job.stopped]
+        while self.post_queue and len(self.post_active) < self.post_parallel:
+            job = self.post_queue.pop(0)
+            self.post_active[job.job_id] = job
+            job.times.exited = None
+            job.times.postprocess_start = time.time()
+            self.log(f"\n--- #{job.job_id} Обработка: {job.url} ---\n", 'info')
+            threading.Thread(target=self._run_post, args=(job,), daemon=True).start()
+        for job in stopped:
+            self._finish_post(job, -1)
+
+    def _run_post(self, job: DownloadJob):
+        """Worker thread: run the post-processors on the downloaded file."""
+        binary = [job.item.command[0]] if job.backend == BACKEND_SUBPROCESS else [sys.executable, '-m', 'yt_dlp']
+        command = postprocess_command(job.item.command, job.info_json, binary)
+        item_log = None
+        try:
+            item_log = ItemLog(job.log_path)
+            item_log.write(f"\nОбработка: {' '.join(command)}\n\n")
+        except OSError as e:
+            self.buffer.put(f"[#{job.job_id}] Не удалось открыть лог-файл: {e}\n", 'error')
+        try:
+            return_code = self._run_subprocess(job, item_log, command)
+            if item_log:
+                item_log.write(f"\n[exit code {return_code}]\n")
+        except Exception as e:
+            self.buffer.post(self._report_error, "Критическая ошибка", f"Ошибка обработки: {e}")
+            return_code = -1
+        finally:
+            job.times.mark('exited')
+            if item_log:
+                item_log.close()
+        self.buffer.post(self._finish_post, job, return_code)
+
+    def _finish_post(self, job: DownloadJob, return_code: int):
+        self.post_active.pop(job.job_id, None)
+        job.return_code = return_code
+        try:
+            os.remove(job.info_json)  # a rerun writes it again
+        except OSError:
+            pass
+        if job.stopped and self.stop_requested and return_code != 0:
+            # the file is already on disk and its ID not yet in the archive (POSTPROCESS_MOVE):
+            # the rerun skips the download and post-processes again
+            self.store.set_state(job.item, 'pending')
+            self.queue.appendleft(job.item)
+            self._record_metrics(job, 'paused')
+            self.on_job_finished(job)
+        else:
+            self._complete(job, return_code)
+        self._dispatch_post()
+        self._dispatch()
+
+    def _record_metrics(self, job: DownloadJob, result: str):
+        self.metrics.record(job, result)
+        self.metrics.write_prom(len(self.active), len(self.queue))
+
+    def _report_error(self, title: str, message: str):
+        self.on_error(title, message)
+
+    def _finish_job(self, job: DownloadJob, return_code: int):
+        self.active.pop(job.job_id, None)
+        self._rebalance()
+        job.return_code = return_code
+        self.finished.append(job)
+        del self.finished[:-LOG_KEEP_FILES]  # older logs are pruned anyway
+        self._slot_freed = job.times.exited
+        if job.stopped and self.stop_requested and return_code != 0:
+            # paused by "Стоп": back to the head of the queue, resumes from .part
+            self.store.set_state(job.item, 'pending')
+            self.queue.appendleft(job.item)
+            self._record_metrics(job, 'paused')
+            self.on_job_finished(job)
+            self._dispatch()
+            self._slot_freed = None
+            return
+        if job.net_threads and not job.stopped:
+            self.tuner.record(job)
+        if return_code != 0 and job.rate_limited and not job.stopped and self._back_off(job):
+            self._record_metrics(job, 'rate_limited')
+            self.on_job_finished(job)
+            self._dispatch()
+            self._slot_freed = None
+            return
+        if return_code != 0 and not job.stopped and not job.rate_limited and self._retry(job):
+            self._record_metrics(job, 'retry')
+            self.on_job_finished(job)
+            self._dispatch()
+            self._slot_freed = None
+            return
+        if return_code == 0 and job.split_post and job.info_json and not job.stopped:
+            # downloaded: hand the file to the post pool and free the slot for the next download
+            job.stage = 'post'
+            self.post_queue.append(job)
+            self._dispatch_post()
+            self._dispatch()
+            self._slot_freed = None
+            return
+        self._complete(job, return_code)
+        # free slot is refilled right away, no inter-item delay
+        self._dispatch()
+        self._slot_freed = None
+
+    def _complete(self, job: DownloadJob, return_code: int):
+        """Final outcome of an item: journal, index, counters."""
+        self._record_metrics(job, 'ok' if return_code == 0 else 'stopped' if job.stopped else 'failed')
+        self._retries.pop(job.item.item_id, None)
+        if return_code == 0:
+            self._rate_strikes.pop(job.item.item_id, None)
+            lane = self.lanes.get(host_lane(job.url))
+            if lane is not None:
+                lane.strikes = 0  # the site is happy again
+            self.store.set_state(job.item, 'done', return_code)
+            if job.item.video_id:
+                self.index.add(job.final_dir, job.item.output_key, job.item.video_id)
+            self.log(f"\n--- #{job.job_id} УСПЕХ ---\n", 'success')
+        else:
+            self.failed += 1
+            self.failed_items.append(job.item)
+            self.store.set_state(job.item, 'failed', return_code)
+            reason = f" ({job.error[len('ERROR:'):].strip()})" if job.error else ''
+            self.log(f"\n--- #{job.job_id} ОШИБКА: Код {return_code}{reason} ---\n", 'error')
+        self.done += 1
+        self.on_job_finished(job)
+
+
+def terminate_process(proc: subprocess.Popen | None):
+    if proc and proc.poll() is None:
+        try:
+            proc.terminate()
+        except Exception:
+            try:
+                proc.kill()
+            except Exception:
+                pass
+
+
+# ---------- Utilities ----------
+def write_json_atomic(path: Path, data):
+    """Write JSON to a temp file next to `path` and rename it over `path`."""
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _option_spans(cmd: list[str], options: dict[str, bool]):
+    """(start, end) of every option from `options` in `cmd` (argv without the URL)."""
+    i = 1
+    while i < len(cmd):
+        takes_value = options.get(cmd[i])
+        if takes_value is None:
+            i += 1
+            continue
+        end = i + 2 if takes_value else i + 1
+        yield i, end
+        i = end
+
+
+def split_postprocess(command: list[str]) -> tuple[list[str], list[str]]:
+    """Split an item's argv into a download-only argv and its POSTPROCESS_OPTIONS.
+
+    The download run writes the info JSON (and the thumbnail/subtitles that are
+    to be embedded) so the post-processing run needs no network. It also leaves
+    out POSTPROCESS_MOVE, which postprocess_command passes on instead.
+    """
+    args, url = command[:-1], command[-1:]
+    spans = list(_option_spans(args, POSTPROCESS_OPTIONS))
+    if not spans:
+        return command, []
+    post = [arg for a, b in spans for arg in args[a:b]]
+    drop = {i for a, b in (*spans, *_option_spans(args, POSTPROCESS_MOVE)) for i in range(a, b)}
+    download = [arg for i, arg in enumerate(args) if i not in drop] + ['--write-info-json']
+    if '--embed-thumbnail' in post:
+        download.append('--write-thumbnail')
+    if '--embed-subs' in post:
+        download.append('--write-subs')
+    return download + url, post
+
+
+def batch_command(command: list[str], path: Path) -> list[str]:
+    """A job's argv with the URL replaced by a batch file; errors don't stop the batch."""
+    return [*command[:-1], '--no-abort-on-error', '-a', str(path)]
+
+
+def postprocess_command(command: list[str], info_json: str, binary: list[str]) -> list[str]:
+    """argv that runs the item's post-processors on the already downloaded file."""
+    args = command[:-1]
+    keep = [arg for a, b in _option_spans(args, {**POSTPROCESS_KEEP, **POSTPROCESS_MOVE}) for arg in args[a:b]]
+    return [*binary, '-v', '--newline', '--load-info-json', info_json, *keep, *split_postprocess(command)[1]]
+
+
+def write_url_file(path: str | Path, urls: list[str]):
+    """One URL per line, as -i and "Импорт…" read them back."""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.writelines(url + '\n' for url in urls)
+
+
+def normalize_url(raw: str) -> str | None:
+    """Canonical form of a pasted URL for dedupe; None if it isn't one."""
+    raw = raw.strip().strip('"\'<>()[]').rstrip('.')
+    if not re.match(r'https?://', raw, re.IGNORECASE):
+        raw = 'https://' + raw
+    parts = urlparse(raw)
+    host = (parts.hostname or '').lower()
+    if '.' not in host:
+        return None
+    vid = video_id_from_url(raw)
+    if vid and host.endswith(('youtube.com', 'youtu.be')):
+        query = [(k, v) for k, v in parse_qsl(parts.query) if k in YOUTUBE_KEEP_PARAMS]
+        return 'https://www.youtube.com/watch?' + urlencode([('v', vid)] + query)
+    netloc = parts.netloc.lower() if not parts.username else parts.netloc
+    return urlunparse((parts.scheme.lower(), netloc, parts.path or '/', parts.params, parts.query, ''))
+
+
+def parse_url_list(text: str) -> list[str]:
+    """Normalised, deduplicated URLs from a paste, a text file or a CSV export, in order."""
+    seen: set[str] = set()
+    urls = []
+    for line in text.splitlines():
+        if line.lstrip().startswith('#'):
+            continue
+        for token in URL_TOKEN_RE.findall(line):
+            url = normalize_url(token)
+            if url and url not in seen:
+                seen.add(url)
+                urls.append(url)
+    return urls
+
+
+def video_id_from_url(url: str) -> str | None:
+    """Video ID if it can be read off the URL itself (YouTube), else None."""
+    m = YOUTUBE_ID_RE.search(url)
+    return m.group(1) if m else None
+
+
+def expected_exts(fmt: str) -> set[str]:
+    """File extensions a FORMAT_OPTIONS expression (or an output_key) ends up as."""
+    if ' -x ' in fmt:  # transcoded: only the target codec counts, not the downloaded original
+        codec = fmt.rsplit(' -x ', 1)[1]
+        return {AUDIO_CODEC_EXTS.get(codec, codec)}
+    if 'ext=webm' in fmt and 'bv' in fmt:
+        return {'webm', 'mkv'}
+    if 'avc1' in fmt or 'ext=mp4' in fmt:
+        return {'mp4', 'mkv'}
+    if 'ext=m4a' in fmt:
+        return {'m4a'}
+    return AUDIO_EXTS
+
+
+def scan_output_dir(final_dir: str, exts: set[str]) -> set[str]:
+    """IDs of finished '... [<id>].<ext>' files in `final_dir`."""
+    found = set()
+    try:
+        with os.scandir(final_dir) as it:
+            for entry in it:
+                m = FILE_ID_RE.search(entry.name)
+                if m and m.group(2).lower() in exts and entry.is_file():
+                    found.add(m.group(1))
+    except OSError:
+        pass
+    return found
+
+
+def probe_binaries(names: list[str]) -> dict[str, str | None]:
+    """Return {name: first line of `name --version`, or None if it can't run}.
+
+    Results are cached in PROBE_CACHE_FILE keyed by the resolved binary path
+    and its mtime, so an unchanged install is never executed again.
+    """
+    try:
+        with open(PROBE_CACHE_FILE, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    dirty = False
+    results: dict[str, str | None] = {}
+    for name in names:
+        found = shutil.which(name)
+        if not found:
+            results[name] = None
+            continue
+        resolved = os.path.realpath(found)
+        try:
+            mtime = os.stat(resolved).st_mtime
+        except OSError:
+            results[name] = None
+            continue
+        entry = cache.get(resolved)
+        if isinstance(entry, dict) and entry.get('mtime') == mtime:
+            results[name] = entry.get('version')
+            continue
+        try:
+            out = subprocess.run([found, '--version'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                 text=True, errors='replace', timeout=30).stdout
+            version = (out.strip().splitlines() or [''])[0]
+        except Exception:
+            results[name] = None
+            continue
+        results[name] = version
+        cache[resolved] = {'mtime': mtime, 'version': version}
+        dirty = True
+    if dirty:
+        try:
+            write_json_atomic(PROBE_CACHE_FILE, cache)
+        except OSError:
+            pass
+    return results
+
+
+def format_bytes(n: float | None) -> str:
+    n = float(n or 0)
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if n < 1024:
+            return f"{n:.1f} {unit}" if unit != 'B' else f"{int(n)} B"
+        n /= 1024
+    return f"{n:.1f} TiB"
+
+
+def format_eta(seconds: float | None) -> str:
+    if seconds is None:
+        return '--:--'
+    m, s = divmod(int(seconds), 60)
+    h, m = divmod(m, 60)
+    return f"{h}:{m:02d}:{s:02d}" if h else f"{m:02d}:{s:02d}"
+
+
+def format_cache_stats(stats: dict, freed: int = 0) -> str:
+    top = sorted(stats['sections'].items(), key=lambda kv: -kv[1])[:3]
+    detail = f" ({', '.join(f'{name} {format_bytes(size)}' for name, size in top)})" if top else ''
+    evicted = f", освобождено {format_bytes(freed)}" if freed else ''
+    return f"Кэш yt-dlp: {stats['files']} файлов, {format_bytes(stats['bytes'])}{detail}{evicted}"
+
+
+def parse_rate(text: str | None) -> int | None:
+    """Bytes/s from a yt-dlp style rate ('40M', '500K', '1.5MiB/s'); None if empty or invalid."""
+    m = RATE_RE.match(text or '')
+    if not m:
+        return None
+    return int(float(m.group(1)) * 1024 ** ' KMGT'.index((m.group(2) or ' ').upper()))
+
+
+def item_rate(item: QueueItem) -> int | None:
+    """The item's own --limit-rate, if it has one."""
+    try:
+        return parse_rate(item.command[item.command.index('--limit-rate') + 1])
+    except (ValueError, IndexError):
+        return None
+
+
+def with_rate_limit(command: list[str], rate: int | None) -> list[str]:
+    """`command` limited to `rate` bytes/s; a lower --limit-rate already in it wins."""
+    if not rate:
+        return command
+    cmd = list(command)
+    if '--limit-rate' in cmd:
+        i = cmd.index('--limit-rate') + 1
+        own = parse_rate(cmd[i])
+        if own is None or own > rate:
+            cmd[i] = str(rate)
+        return cmd
+    return cmd[:-1] + ['--limit-rate', str(rate), cmd[-1]]
+
+
+def with_net_threads(command: list[str], n: int | None) -> list[str]:
+    """`command` with its -N value replaced by `n`."""
+    if not n or '-N' not in command:
+        return command
+    cmd = list(command)
+    cmd[cmd.index('-N') + 1] = str(n)
+    return cmd
+
+
+def job_net_threads(job: DownloadJob) -> int | None:
+    """-N the job actually ran with."""
+    cmd = job.command
+    try:
+        return int(cmd[cmd.index('-N') + 1])
+    except (ValueError, IndexError):
+        return None
+
+
+def url_host(url: str) -> str:
+    host = (urlparse(url).hostname or '').lower()
+    return host[4:] if host.startswith('www.') else host
+
+
+@functools.lru_cache(maxsize=4096)
+def host_lane(url: str) -> str:
+    """Scheduling lane of a URL: its site, with known mirrors folded together."""
+    host = url_host(url)
+    return HOST_ALIASES.get(host, host)
+
+
+def sanitize_subfolder(name: str) -> str:
+    name = (name or '').strip() or DEFAULT_SUBFOLDER
+    # Windows forbidden characters
+    forbidden = r'<>:"/\\|?*'
+    return ''.join(ch for ch in name if ch not in forbidden)
+
+
+def _format_filter(f: dict, key: str, op: str, value: str) -> bool:
+    have = f.get(key)
+    if have is None:
+        return False  # yt-dlp drops formats missing a filtered field too
+    if op in ('*=', '^=', '$='):
+        have = str(have)
+        return value in have if op == '*=' else have.startswith(value) if op == '^=' else have.endswith(value)
+    try:
+        have, value = float(have), float(value)
+    except (TypeError, ValueError):
+        have = str(have)
+    return {'=': have == value, '!=': have != value, '<=': have <= value, '>=': have >= value,
+            '<': have < value, '>': have > value}[op]
+
+
+def _pick_format(spec: str, formats: list[dict]) -> dict | None:
+    """Best format for one selector ('bv*[ext=webm][height<=1080]'); None if nothing fits."""
+    m = FORMAT_SPEC_RE.match(spec.strip())
+    if not m:
+        raise ValueError(spec)
+    kind = {'b': 'b', 'best': 'b', 'bv': 'v', 'bestvideo': 'v', 'ba': 'a', 'bestaudio': 'a',
+            'bv*': 'v*', 'bestvideo*': 'v*', 'ba*': 'a*', 'bestaudio*': 'a*', 'b*': 'b*', 'best*': 'b*'}.get(m.group(1))
+    if kind is None:
+        raise ValueError(spec)
+    filters = FORMAT_FILTER_RE.findall(m.group(2))
+    best, best_key = None, None
+    for f in formats:
+        video, audio = f.get('vcodec') != 'none', f.get('acodec') != 'none'
+        if not {'b': video and audio, 'b*': video or audio, 'v': video and not audio, 'v*': video,
+                'a': audio and not video, 'a*': audio}[kind]:
+            continue
+        if not all(_format_filter(f, *flt) for flt in filters):
+            continue
+        key = (f.get('height') or 0, f.get('tbr') or f.get('abr') or 0)
+        if best_key is None or key > best_key:
+            best, best_key = f, key
+    return best
+
+
+def match_format(fmt: str, formats: list[dict]) -> list[dict] | None:
+    """Formats a -f expression would download: [] if nothing matches, None if the
+    expression uses syntax beyond what FORMAT_OPTIONS needs ('/' fallbacks, '+'
+    merges, [field op value] filters)."""
+    try:
+        for alternative in fmt.split('/'):
+            picks = [_pick_format(spec, formats) for spec in alternative.split('+')]
+            if all(picks):
+                return picks
+    except ValueError:
+        return None
+    return []
+
+
+def estimate_size(picks: list[dict], duration: float | None) -> int | None:
+    """Bytes the chosen formats add up to; None if a format has neither size nor bitrate."""
+    total = 0
+    for f in picks:
+        size = f.get('filesize') or f.get('filesize_approx')
+        if not size and f.get('tbr') and duration:
+            size = f['tbr'] * 1000 / 8 * duration  # tbr is kbit/s
+        if not size:
+            return None
+        total += size
+    return int(total)
+
+
+def find_format(name: str) -> str:
+    """-f expression for a FORMAT_OPTIONS preset ('1080p', 'Аудио - MP3 (192kbps)').
+
+    Anything that isn't a preset name is taken as a raw -f expression.
+    """
+    for category, options in FORMAT_OPTIONS.items():
+        for label, fmt in options.items():
+            if name in (label, f"{category} - {label}"):
+                return fmt
+    return name
+
+
+# ==========================
+#  Headless mode
+# ==========================
+def _read_urls(engine: QueueEngine, path: str, options: DownloadOptions, final_dir: str, daemon: bool):
+    """Input thread: hand every URL to the engine thread; '#' starts a comment."""
+    while True:
+        try:
+            f = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+        except OSError as e:
+            engine.buffer.put(f"Не удалось открыть {path}: {e}\n", 'error')
+            break
+        with f:
+            if path == '-':
+                # a terminal or a slow producer: queue each line as it comes
+                for line in f:
+                    url = line.split('#', 1)[0].strip()
+                    if url:
+                        engine.buffer.post(engine.add_url, url, options, final_dir)
+            else:
+                # a file or one FIFO writer: one normalised batch
+                engine.buffer.post(engine.add_urls, parse_url_list(f.read()), options, final_dir)
+        # a FIFO reports EOF whenever its last writer closes; wait for the next one
+        if not (daemon and path != '-'):
+            break
+    engine.buffer.post(_input_done, engine)
+
+
+def _input_done(engine: QueueEngine):
+    engine.keep_alive = False
+    engine._dispatch()
+
+
+def main(argv: list[str] | None = None) -> int:
+    settings = SettingsStore()
+    parser = argparse.ArgumentParser(
+        prog='python -m ytdlp_engine',
+        description="Очередь yt-dlp без GUI: те же пресеты, журнал и параллельность, что и в окне. "
+                    "Значения по умолчанию берутся из настроек GUI.")
+    parser.add_argument('-i', '--input', default='-',
+                        help="файл со ссылками, по одной в строке ('-' = stdin, по умолчанию)")
+    parser.add_argument('-f', '--format',
+                        help="пресет из FORMAT_OPTIONS ('1080p', 'MP3 (192kbps)') или выражение -f")
+    parser.add_argument('-o', '--output', help="папка для загрузки")
+    parser.add_argument('-j', '--jobs', type=int, help="сколько yt-dlp запускать параллельно")
+    parser.add_argument('--batch', type=int,
+                        help=f"ссылок с одинаковыми настройками на один запуск yt-dlp (1 = каждую отдельно, "
+                             f"по умолчанию {DEFAULT_BATCH_ITEMS})")
+    parser.add_argument('--per-host', type=int,
+                        help=f"сколько загрузок с одного сайта одновременно (0 = без ограничения, по умолчанию {DEFAULT_HOST_PARALLEL})")
+    parser.add_argument('--post-jobs', type=int, default=POSTPROCESS_PARALLEL,
+                        help=f"параллельных перекодирований/встраиваний после загрузки "
+                             f"(0 = в слоте загрузки, по умолчанию {POSTPROCESS_PARALLEL})")
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES,
+                        help=f"сколько раз повторять сбойную загрузку (по умолчанию {DEFAULT_RETRIES})")
+    parser.add_argument('--sjf', action='store_true',
+                        help="сначала короткие загрузки (по длительности/размеру), а не по порядку очереди")
+    parser.add_argument('--failed-file', help="записать ссылки окончательно сбойных загрузок в этот файл")
+    parser.add_argument('-N', '--net-threads', help="потоков на загрузку (-N yt-dlp) или 'auto'")
+    parser.add_argument('--aria2', action=argparse.BooleanOptionalAction, default=None,
+                        help="качать HTTP(S)/FTP через aria2c")
+    parser.add_argument('--aria2-connections', type=int, help=f"aria2c -x (по умолчанию {DEFAULT_ARIA2_CONNECTIONS})")
+    parser.add_argument('--aria2-split', type=int, help=f"aria2c -s (по умолчанию {DEFAULT_ARIA2_SPLIT})")
+    parser.add_argument('--limit-rate', help="лимит скорости, напр. 5M")
+    parser.add_argument('--total-rate', help="общий лимит скорости на все загрузки, напр. 40M")
+    parser.add_argument('--playlist', action=argparse.BooleanOptionalAction, default=None,
+                        help="раскрывать плейлисты в отдельные видео")
+    parser.add_argument('--backend', choices=(BACKEND_SUBPROCESS, BACKEND_INPROCESS),
+                        help="subprocess: yt-dlp на каждую ссылку; inprocess: модуль yt_dlp в тёплых процессах")
+    parser.add_argument('--daemon', action='store_true',
+                        help="не выходить после конца ввода: переоткрывать файл (FIFO) и ждать новые ссылки")
+    parser.add_argument('--list-formats', action='store_true', help="показать пресеты и выйти")
+    parser.add_argument('--cache-stats', action='store_true', help="показать, что в кэше yt-dlp, и выйти")
+    parser.add_argument('--no-cache-warmup', action='store_true',
+                        help="не прогревать кэш yt-dlp перед параллельными загрузками с одного сайта")
+    args = parser.parse_args(argv)
+
+    if args.list_formats:
+        for category, options in FORMAT_OPTIONS.items():
+            for label, fmt in options.items():
+                print(f"{category} - {label}: {fmt}")
+        return 0
+    if args.cache_stats:
+        stats = YtdlpCache().stats()
+        print(format_cache_stats(stats))
+        for section, size in sorted(stats['sections'].items()):
+            print(f"  {section}: {format_bytes(size)}")
+        return 0
+
+    options = DownloadOptions.from_settings(settings, args.format)
+    if args.net_threads and args.net_threads != 'auto':
+        try:
+            options.net_threads = int(args.net_threads)
+        except ValueError:
+            parser.error(f"-N: ожидается число или 'auto', получено {args.net_threads!r}")
+    if args.limit_rate is not None:
+        options.limit_rate = args.limit_rate
+    if args.aria2 is not None:
+        options.aria2 = args.aria2
+    if args.aria2_connections:
+        options.aria2_connections = args.aria2_connections
+    if args.aria2_split:
+        options.aria2_split = args.aria2_split
+    if args.playlist is not None:
+        options.playlist_all = args.playlist
+    final_dir = args.output or os.path.join(settings.get('download_path', DEFAULT_DOWNLOAD_DIR),
+                                            sanitize_subfolder(settings.get('subfolder', DEFAULT_SUBFOLDER)))
+
+    engine = QueueEngine()
+    opts = settings.get('opts')
+    opts = opts if isinstance(opts, dict) else {}
+    engine.max_parallel = args.jobs or opts.get('max_parallel') or DEFAULT_MAX_PARALLEL
+    host_limit = args.per_host if args.per_host is not None else opts.get('host_limit')
+    engine.host_limit = DEFAULT_HOST_PARALLEL if host_limit is None else host_limit
+    batch_items = args.batch if args.batch is not None else opts.get('batch_items')
+    engine.batch_items = DEFAULT_BATCH_ITEMS if batch_items is None else max(1, min(MAX_BATCH_ITEMS, batch_items))
+    engine.max_retries = max(0, args.retries)
+    engine.post_parallel = max(0, args.post_jobs)
+    engine.set_sjf(args.sjf or bool(opts.get('sjf')))
+    engine.cache_warmup = not args.no_cache_warmup
+    engine.total_rate = parse_rate(args.total_rate if args.total_rate is not None else opts.get('total_rate'))
+    engine.auto_threads = args.net_threads == 'auto' if args.net_threads else bool(opts.get('auto_threads'))
+    engine.backend = args.backend or (BACKEND_INPROCESS if opts.get('inprocess') else BACKEND_SUBPROCESS)
+    engine.on_log = lambda lines: sys.stdout.write(''.join(text for text, _tag in lines))
+    engine.on_error = lambda title, message: print(f"{title}: {message}", file=sys.stderr)
+    prune_item_logs()
+
+    engine.keep_alive = True
+    engine.restore()
+    engine.start()
+    threading.Thread(target=_read_urls, args=(engine, args.input, options, final_dir, args.daemon),
+                     daemon=True).start()
+
+    last_status = time.monotonic()
+    try:
+        while not engine.idle or engine.keep_alive:
+            engine.pump()
+            sys.stdout.flush()
+            now = time.monotonic()
+            if engine.active and now - last_status >= CLI_STATUS_INTERVAL:
+                last_status = now
+                speed = sum(job.speed for job in engine.active.values())
+                print(f"[очередь] активно {len(engine.active)}, готово {engine.done}/{engine.total}, "
+                      f"{format_bytes(speed)}/s", file=sys.stderr)
+            time.sleep(CLI_TICK)
+        engine.pump()
+    except KeyboardInterrupt:
+        engine.shutdown()
+        print("\nПрервано; незавершённые загрузки продолжатся при следующем запуске.", file=sys.stderr)
+        return 130
+    engine.close()
+    if args.failed_file and engine.failed_items:
+        write_url_file(args.failed_file, [item.url for item in engine.failed_items])
+        print(f"Сбойные ссылки ({len(engine.failed_items)}): {args.failed_file}", file=sys.stderr)
+    return 1 if engine.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())